@@ -1,14 +1,44 @@
 # Import modules
 import os
 from flask import (
-    Flask, flash, render_template,
-    redirect, request, session, url_for, Markup)
+    Flask, flash, render_template, jsonify, make_response, Response,
+    get_template_attribute, redirect, request, session, url_for, Markup,
+    stream_with_context, g, has_request_context, send_from_directory)
 from flask_pymongo import PyMongo
+from jinja2 import FileSystemBytecodeCache, Template
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.collation import Collation
+from pymongo.errors import BulkWriteError, PyMongoError
 from bson.objectid import ObjectId
-from datetime import date
-from werkzeug.security import generate_password_hash, check_password_hash
+from bson.errors import InvalidId
+from datetime import date, datetime, timedelta
+import base64
+import binascii
+import json
+from collections import defaultdict, OrderedDict
+import atexit
+import click
+import concurrent.futures
+import contextvars
+import csv
+import gzip
+import hashlib
+import hmac
+import sys
+import threading
+import mimetypes
+import time
+import zlib
+from werkzeug.security import (
+    generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS)
 import re
 from better_profanity import profanity
+from better_profanity.constants import ALLOWED_CHARACTERS
+try:
+    import brotli
+except ImportError:
+    # Assets are only precompressed with gzip without it
+    brotli = None
 if os.path.exists("env.py"):
     import env
 
@@ -19,347 +49,2469 @@ app = Flask(__name__)
 app.config["MONGO_DBNAME"] = os.environ.get("MONGO_DBNAME")
 app.config["MONGO_URI"] = os.environ.get("MONGO_URI")
 app.secret_key = os.environ.get("SECRET_KEY")
+app.config["TERMS_PER_PAGE"] = int(os.environ.get("TERMS_PER_PAGE", 50))
+app.config["MAX_TERMS_PER_PAGE"] = int(
+    os.environ.get("MAX_TERMS_PER_PAGE", 200))
+app.config["PROFILE_TOP_RATED"] = int(
+    os.environ.get("PROFILE_TOP_RATED", 1))
+app.config["SEARCH_RESULTS_LIMIT"] = int(
+    os.environ.get("SEARCH_RESULTS_LIMIT", 20))
+app.config["MAX_SEARCH_RESULTS"] = int(
+    os.environ.get("MAX_SEARCH_RESULTS", 100))
+app.config["SEARCH_MIN_PREFIX"] = int(
+    os.environ.get("SEARCH_MIN_PREFIX", 3))
+app.config["SEARCH_CANDIDATES"] = int(
+    os.environ.get("SEARCH_CANDIDATES", 500))
+app.config["EXPORT_BATCH_SIZE"] = int(
+    os.environ.get("EXPORT_BATCH_SIZE", 500))
+app.config["VOTE_WRITE_BEHIND"] = os.environ.get(
+    "VOTE_WRITE_BEHIND", "").lower() in ("1", "true", "yes")
+app.config["VOTE_FLUSH_INTERVAL"] = float(
+    os.environ.get("VOTE_FLUSH_INTERVAL", 2))
+app.config["VOTE_FLUSH_THRESHOLD"] = int(
+    os.environ.get("VOTE_FLUSH_THRESHOLD", 500))
+app.config["VOTE_SPILL_PATH"] = os.environ.get(
+    "VOTE_SPILL_PATH", "vote_buffer.log")
+app.config["GAMES_CACHE_TTL"] = float(
+    os.environ.get("GAMES_CACHE_TTL", 300))
+app.config["USERNAME_CACHE_TTL"] = float(
+    os.environ.get("USERNAME_CACHE_TTL", 300))
+app.config["USERNAME_CACHE_SIZE"] = int(
+    os.environ.get("USERNAME_CACHE_SIZE", 10000))
+app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE", 256))
+app.config["PAGE_CACHE_TTL"] = float(os.environ.get("PAGE_CACHE_TTL", 300))
+app.config["FRAGMENT_CACHE_SIZE"] = int(
+    os.environ.get("FRAGMENT_CACHE_SIZE", 5000))
+app.config["DICTIONARY_VERSION_TTL"] = float(
+    os.environ.get("DICTIONARY_VERSION_TTL", 1))
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get(
+    "PASSWORD_HASH_METHOD", f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}")
+app.config["PASSWORD_SALT_LENGTH"] = int(
+    os.environ.get("PASSWORD_SALT_LENGTH", 16))
+app.config["PASSWORD_HASH_WORKERS"] = int(
+    os.environ.get("PASSWORD_HASH_WORKERS", 2))
+app.config["ASGI_WSGI_THREADS"] = int(
+    os.environ.get("ASGI_WSGI_THREADS", 8))
+app.config["SLOW_REQUEST_SECONDS"] = float(
+    os.environ.get("SLOW_REQUEST_SECONDS", 0))
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+app.config["TRENDING_HALF_LIFE_HOURS"] = float(
+    os.environ.get("TRENDING_HALF_LIFE_HOURS", 24))
+app.config["TRENDING_EPOCH_HOURS"] = float(
+    os.environ.get("TRENDING_EPOCH_HOURS", 24))
+app.config["TRENDING_DECAY_INTERVAL"] = float(
+    os.environ.get("TRENDING_DECAY_INTERVAL", 3600))
+app.config["GAME_DELETE_CHUNK_SIZE"] = int(
+    os.environ.get("GAME_DELETE_CHUNK_SIZE", 500))
+app.config["GAME_DELETE_LEASE_SECONDS"] = float(
+    os.environ.get("GAME_DELETE_LEASE_SECONDS", 60))
+app.config["STATIC_ASSET_MAX_AGE"] = int(
+    os.environ.get("STATIC_ASSET_MAX_AGE", 31536000))
+app.config["COMPRESS_MIN_SIZE"] = int(
+    os.environ.get("COMPRESS_MIN_SIZE", 1024))
+app.config["GZIP_LEVEL"] = int(os.environ.get("GZIP_LEVEL", 6))
+app.config["BROTLI_QUALITY"] = int(os.environ.get("BROTLI_QUALITY", 5))
+app.config["TRIM_TEMPLATE_WHITESPACE"] = os.environ.get(
+    "TRIM_TEMPLATE_WHITESPACE", "1").lower() in ("1", "true", "yes")
+app.config["TEMPLATE_CACHE_DIR"] = os.environ.get(
+    "TEMPLATE_CACHE_DIR", os.path.join(app.root_path, ".template_cache"))
+
+# Fields covered by the search index and how much a match in each is worth
+SEARCH_FIELD_WEIGHTS = {
+    "term_header": 3,
+    "short_definition": 2,
+    "long_description": 1
+}
+# Fields that can be requested from the export, with the stored fields
+# each one is built from
+EXPORT_FIELDS = {
+    "_id": "_id",
+    "term_header": "term_header",
+    "game_name": "game_fk",
+    "short_definition": "short_definition",
+    "long_description": "long_description",
+    "youtube_link": "youtube_link",
+    "username": "submitted_by",
+    "submission_date": "submission_date",
+    "rating": "rating"
+}
+# Fields of a definition returned by the JSON API, in order. Fields used
+# only for storage, such as the letter index and trending score, are left
+# out so that they can change without changing the API.
+PUBLIC_TERM_FIELDS = (
+    "_id", "term_header", "game_fk", "game_name", "short_definition",
+    "long_description", "youtube_link", "submitted_by", "username",
+    "submission_date", "rating", "upvotes", "downvotes", "score")
+# Text fields of a definition that are checked for profanity
+DEFINITION_TEXT_FIELDS = ("term_header", "short_definition",
+                          "long_description")
+# Minimum share of a word's trigrams a term must contain to be a fuzzy match
+TRIGRAM_THRESHOLD = 0.5
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Upper bounds in seconds of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestMetrics:
+    """
+    Thread safe totals for each route of the requests served, their latency,
+    the MongoDB commands they sent and the time spent rendering templates.
+    Exported in the Prometheus text format by the metrics route.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency_buckets = defaultdict(lambda: [0] * len(buckets))
+        self.latency_sum = defaultdict(float)
+        self.latency_count = defaultdict(int)
+        self.commands = defaultdict(int)
+        self.command_seconds = defaultdict(float)
+        self.documents = defaultdict(int)
+        self.render_seconds = defaultdict(float)
+        self.renders = defaultdict(int)
+
+    def recordQueries(self, route, queries):
+        """
+        Add the MongoDB commands sent while serving a route to its totals
+        """
+        with self.lock:
+            for query in queries:
+                key = (route, query["command"])
+                self.commands[key] += 1
+                self.command_seconds[key] += query["duration"]
+                self.documents[route] += query["documents"]
+
+    def recordRequest(self, route, method, status, seconds, queries,
+                      render_seconds, renders):
+        """
+        Add a finished request and everything it did to its route's totals
+        """
+        self.recordQueries(route, queries)
+        with self.lock:
+            self.requests[(route, method, str(status))] += 1
+            counts = self.latency_buckets[route]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[index] += 1
+            self.latency_sum[route] += seconds
+            self.latency_count[route] += 1
+            self.render_seconds[route] += render_seconds
+            self.renders[route] += renders
+
+    def export(self):
+        """
+        Return every total in the Prometheus text exposition format
+        """
+        def labels(**values):
+            return "{" + ",".join(
+                f'{name}="{value}"' for name, value in values.items()) + "}"
+
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{sample} {value}" for sample, value in samples)
+
+        with self.lock:
+            metric("esd_http_requests_total", "counter",
+                   "Requests served by route, method and status.",
+                   [("esd_http_requests_total" + labels(
+                       route=route, method=method, status=status), count)
+                    for (route, method, status), count
+                    in sorted(self.requests.items())])
+            latency = []
+            for route in sorted(self.latency_count):
+                name = "esd_http_request_duration_seconds"
+                for bound, count in zip(self.buckets,
+                                        self.latency_buckets[route]):
+                    latency.append((name + "_bucket" + labels(
+                        route=route, le=bound), count))
+                latency.append((name + "_bucket" + labels(
+                    route=route, le="+Inf"), self.latency_count[route]))
+                latency.append((name + "_sum" + labels(route=route),
+                                self.latency_sum[route]))
+                latency.append((name + "_count" + labels(route=route),
+                                self.latency_count[route]))
+            metric("esd_http_request_duration_seconds", "histogram",
+                   "Time taken to serve requests by route.", latency)
+            metric("esd_mongo_commands_total", "counter",
+                   "MongoDB commands sent by route and command.",
+                   [("esd_mongo_commands_total" + labels(
+                       route=route, command=command), count)
+                    for (route, command), count
+                    in sorted(self.commands.items())])
+            metric("esd_mongo_command_seconds_total", "counter",
+                   "Time spent waiting for MongoDB commands by route and "
+                   "command.",
+                   [("esd_mongo_command_seconds_total" + labels(
+                       route=route, command=command), seconds)
+                    for (route, command), seconds
+                    in sorted(self.command_seconds.items())])
+            metric("esd_mongo_documents_returned_total", "counter",
+                   "Documents returned by MongoDB by route.",
+                   [("esd_mongo_documents_returned_total" + labels(
+                       route=route), count)
+                    for route, count in sorted(self.documents.items())])
+            metric("esd_template_render_seconds_total", "counter",
+                   "Time spent rendering templates by route.",
+                   [("esd_template_render_seconds_total" + labels(
+                       route=route), seconds)
+                    for route, seconds in sorted(
+                        self.render_seconds.items())])
+            metric("esd_template_renders_total", "counter",
+                   "Templates rendered by route.",
+                   [("esd_template_renders_total" + labels(route=route),
+                     count) for route, count in sorted(self.renders.items())])
+        return "\n".join(lines) + "\n"
+
+
+def countReturnedDocuments(reply):
+    """
+    Count the documents in a MongoDB command's reply
+    """
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "value" in reply:
+        # findAndModify returns the document it updated, if any
+        return 1 if reply["value"] else 0
+    return 0
+
+
+# The MongoDB commands sent for the current request. A context variable
+# rather than g, so that commands Motor sends from its threads for the ASGI
+# routes are charged to the request that awaited them.
+request_queries = contextvars.ContextVar("request_queries", default=None)
+
+
+class QueryMonitor(monitoring.CommandListener):
+    """
+    Records every command sent to MongoDB against the request that sent it,
+    with its duration and the number of documents it returned. Commands
+    sent outside a request, such as vote buffer flushes, are counted
+    against the "background" route.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self.lock:
+            self.collections[event.request_id] = (
+                collection if isinstance(collection, str) else None)
+
+    def succeeded(self, event):
+        self.record(event, countReturnedDocuments(event.reply))
+
+    def failed(self, event):
+        self.record(event, 0)
+
+    def record(self, event, documents):
+        with self.lock:
+            collection = self.collections.pop(event.request_id, None)
+        query = {
+            "command": event.command_name,
+            "collection": collection,
+            "duration": event.duration_micros / 1000000,
+            "documents": documents
+        }
+        queries = request_queries.get()
+        if queries is not None:
+            queries.append(query)
+        else:
+            request_metrics.recordQueries("background", [query])
+
+
+class TimedTemplate(Template):
+    """
+    Template that adds the time it takes to render to the current request's
+    total
+    """
+
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            if has_request_context() and "render_seconds" in g:
+                g.render_seconds += time.perf_counter() - started
+                g.renders += 1
+
+
+request_metrics = RequestMetrics(LATENCY_BUCKETS)
+app.jinja_env.template_class = TimedTemplate
+# Drop the whitespace left by block tags, which is most of the whitespace
+# in the rendered pages
+app.jinja_env.trim_blocks = app.config["TRIM_TEMPLATE_WHITESPACE"]
+app.jinja_env.lstrip_blocks = app.config["TRIM_TEMPLATE_WHITESPACE"]
+if app.config["TEMPLATE_CACHE_DIR"]:
+    # Keep compiled templates on disk so that new processes don't compile
+    # them again. Trimming changes the compiled code, so each setting has
+    # its own files.
+    os.makedirs(app.config["TEMPLATE_CACHE_DIR"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+        app.config["TEMPLATE_CACHE_DIR"], "__jinja2_{}_%s.cache".format(
+            "trimmed" if app.config["TRIM_TEMPLATE_WHITESPACE"] else "full"))
+
+
+@app.before_request
+def startRequestMetrics():
+    """
+    Start timing the request and collecting the MongoDB commands it sends.
+    The ASGI entry point records when it received the request and the
+    commands it sent before the request context was pushed, so that they
+    are included.
+    """
+    g.request_started = request.environ.get(
+        "metrics.started", time.perf_counter())
+    g.queries = request.environ.get("metrics.queries", [])
+    request_queries.set(g.queries)
+    g.render_seconds = 0.0
+    g.renders = 0
+
+
+@app.after_request
+def recordRequestMetrics(response):
+    """
+    Add the finished request to the metrics for its route, and log a
+    breakdown of its MongoDB commands if it took longer than
+    SLOW_REQUEST_SECONDS. Streamed responses send their queries as the body
+    is sent, so they are recorded when the stream is closed.
+    """
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    route = request.url_rule.endpoint if request.url_rule else "unmatched"
+    method = request.method
+    path = request.full_path.rstrip("?")
+    queries = g.queries
+    render_seconds = g.render_seconds
+    renders = g.renders
+
+    def record():
+        request_queries.set(None)
+        seconds = time.perf_counter() - started
+        request_metrics.recordRequest(
+            route, method, response.status_code, seconds, queries,
+            render_seconds, renders)
+        threshold = app.config["SLOW_REQUEST_SECONDS"]
+        if threshold and seconds >= threshold:
+            app.logger.warning(
+                "Slow request: %s %s took %.1fms, with %d MongoDB commands "
+                "taking %.1fms and %.1fms rendering templates%s",
+                method, path, seconds * 1000, len(queries),
+                sum(query["duration"] for query in queries) * 1000,
+                render_seconds * 1000,
+                "".join(f"\n  {query['command']} {query['collection']}: "
+                        f"{query['duration'] * 1000:.1f}ms, "
+                        f"{query['documents']} documents"
+                        for query in queries))
+
+    if response.is_streamed:
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+# Content types that are compressed, and the encodings they can be
+# compressed with in order of preference
+COMPRESSED_MIMETYPES = frozenset((
+    "text/html", "text/plain", "text/css", "text/javascript",
+    "application/javascript", "application/json", "application/x-ndjson"))
+RESPONSE_ENCODINGS = ("br", "gzip")
+
+
+def chooseEncoding():
+    """
+    Return the preferred encoding accepted by the client, or None if it
+    doesn't accept any of RESPONSE_ENCODINGS
+    """
+    for encoding in RESPONSE_ENCODINGS:
+        if encoding == "br" and brotli is None:
+            continue
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def getCompressor(encoding):
+    """
+    Return functions that compress a chunk of data and finish the stream
+    for the encoding
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=app.config["BROTLI_QUALITY"])
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(app.config["GZIP_LEVEL"], zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def compressBody(data, encoding):
+    """
+    Compress a complete response body
+    """
+    compress, finish = getCompressor(encoding)
+    return compress(data) + finish()
+
+
+def compressStream(chunks, encoding, charset="utf-8"):
+    """
+    Compress a stream of text or bytes chunks as they are generated
+    """
+    compress, finish = getCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = compress(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+@app.after_request
+def compressResponse(response):
+    """
+    Compress text responses with the best encoding the client accepts.
+    Bodies smaller than COMPRESS_MIN_SIZE bytes are sent as they are, and
+    streamed responses are compressed as they are generated. Strong ETags
+    are made weak, as the compressed body differs from the original.
+    """
+    if (response.direct_passthrough or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSED_MIMETYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = chooseEncoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compressStream(
+            response.response, encoding, response.charset)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compressBody(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# Add PyMongo, recording the commands each request sends
+mongo = PyMongo(app, event_listeners=[QueryMonitor()])
+
+# Compares text ignoring case, so that usernames and game names can be
+# matched case insensitively using an index
+CASE_INSENSITIVE = Collation(locale="en", strength=2)
+
+# Indexes needed by the queries each route makes, created on startup
+INDEXES = {
+    "users": [
+        ([("username", 1)], {"name": "username"}),
+        ([("username", 1)], {"name": "username_ci",
+                             "collation": CASE_INSENSITIVE}),
+    ],
+    "games": [
+        ([("game_name", 1)], {"name": "game_name"}),
+        ([("game_name", 1)], {"name": "game_name_ci",
+                              "collation": CASE_INSENSITIVE}),
+    ],
+    "terms": [
+        ([("rating", 1), ("term_header", 1)],
+         {"name": "rating_term_header"}),
+        ([("term_header", 1), ("rating", -1), ("_id", 1)],
+         {"name": "term_header_rating"}),
+        ([("submitted_by", 1), ("term_header", 1), ("rating", -1),
+          ("_id", 1)], {"name": "submitted_by_term_header"}),
+        ([("submitted_by", 1), ("rating", -1), ("_id", 1)],
+         {"name": "submitted_by_rating"}),
+        ([("game_fk", 1), ("term_header", 1), ("rating", -1), ("_id", 1)],
+         {"name": "game_fk_term_header"}),
+        ([("letter", 1), ("term_header", 1), ("rating", -1), ("_id", 1)],
+         {"name": "letter_term_header"}),
+        ([("trending_score", -1), ("_id", 1)], {"name": "trending_score"}),
+        ([("trending_epoch", 1)], {"name": "trending_epoch"}),
+    ],
+    "search_index": [
+        ([("kind", 1), ("token", 1)], {"name": "kind_token"}),
+        ([("term_id", 1)], {"name": "term_id"}),
+    ],
+    "votes": [
+        ([("term_id", 1), ("user_id", 1)],
+         {"name": "term_id_user_id", "unique": True}),
+    ],
+}
+
+
+def ensureIndexes():
+    """
+    Create any of the indexes in INDEXES that don't exist yet. Returns a
+    list of the indexes that are still missing afterwards.
+    """
+    missing = []
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            mongo.db[collection].create_index(keys, **options)
+        existing = mongo.db[collection].index_information()
+        missing += [
+            f"{collection}.{options['name']}" for keys, options in indexes
+            if options["name"] not in existing]
+    return missing
+
+
+@app.before_first_request
+def bootstrapIndexes():
+    """
+    Make sure the indexes the routes rely on exist before the first request
+    is handled. Failures are logged rather than stopping the app.
+    """
+    try:
+        missing = ensureIndexes()
+    except PyMongoError as error:
+        app.logger.error("Could not create indexes: %s", error)
+        return
+    if missing:
+        app.logger.error("Indexes missing: %s", ", ".join(missing))
+
+
+class TTLCache:
+    """
+    Thread safe in-process cache for reference data. Entries expire after
+    ttl seconds and the least recently used entries are evicted once the
+    cache holds maxsize entries. Hits, misses and evictions are counted so
+    that the cache's effectiveness can be checked.
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key):
+        """
+        Return (True, value) for a live entry, or (False, None) otherwise.
+        Must be called with the lock held.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, calling loader to fetch and store it
+        if it isn't cached or has expired
+        """
+        with self.lock:
+            found, value = self.lookup(key)
+        if found:
+            return value
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def getMany(self, keys):
+        """
+        Return a dictionary of the cached values for the keys provided and a
+        list of the keys that weren't cached
+        """
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                cached, value = self.lookup(key)
+                if cached:
+                    found[key] = value
+                else:
+                    missing.append(key)
+        return found, missing
+
+    def peek(self, key):
+        """
+        Check whether key has a live entry without counting a hit or miss or
+        changing which entries will be evicted first
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        Remove an entry from the cache, or every entry if no key is given
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+# Games only change through the admin pages and usernames through
+# edit_user, so both are cached and updated when those routes write
+games_cache = TTLCache("games", 2, app.config["GAMES_CACHE_TTL"])
+letters_cache = TTLCache("letters", 1, app.config["GAMES_CACHE_TTL"])
+username_cache = TTLCache(
+    "usernames", app.config["USERNAME_CACHE_SIZE"],
+    app.config["USERNAME_CACHE_TTL"])
+
+
+# Rendered dictionary pages for logged out visitors, keyed by the
+# dictionary version, and the parts of each term that every visitor shares
+page_cache = TTLCache(
+    "pages", app.config["PAGE_CACHE_SIZE"], app.config["PAGE_CACHE_TTL"])
+fragment_cache = TTLCache(
+    "fragments", app.config["FRAGMENT_CACHE_SIZE"],
+    app.config["PAGE_CACHE_TTL"])
+version_cache = TTLCache(
+    "dictionary_version", 1, app.config["DICTIONARY_VERSION_TTL"])
+
+# Fields that change how a term's cached summary is rendered
+FRAGMENT_FIELDS = (
+    "_id", "term_header", "game_name", "short_definition", "username")
+# Fields of each term fetched for the dictionary listing. Descriptions and
+# videos are loaded separately when a term is expanded.
+LISTING_PROJECTION = {
+    "term_header": 1, "game_fk": 1, "short_definition": 1,
+    "submitted_by": 1, "rating": 1}
+# Fields needed to render a term's details
+DETAILS_PROJECTION = {
+    "short_definition": 1, "long_description": 1, "youtube_link": 1}
+
+
+def getDictionaryVersion():
+    """
+    Return the current version of the dictionary. The version is shared
+    between processes through the database and checked at most once every
+    DICTIONARY_VERSION_TTL seconds.
+    """
+    def loadVersion():
+        counter = mongo.db.counters.find_one({"_id": "dictionary"})
+        return counter["version"] if counter else 0
+    return version_cache.get("version", loadVersion)
+
+
+def bumpDictionaryVersion():
+    """
+    Record that the dictionary has changed so that cached pages are no
+    longer served. Called by every route that changes terms, votes, games
+    or usernames.
+    """
+    counter = mongo.db.counters.find_one_and_update(
+        {"_id": "dictionary"}, {"$inc": {"version": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    version_cache.set("version", counter["version"])
+
+
+def renderTermFragments(terms):
+    """
+    Attach the rendered summary of each term, reusing the fragments already
+    rendered for the same version of a term
+    """
+    term_summary = get_template_attribute("term_macros.html", "term_summary")
+    for term in terms:
+        key = tuple(str(term.get(field)) for field in FRAGMENT_FIELDS)
+        term["summary_html"] = fragment_cache.get(
+            key, lambda: term_summary(term))
+    return terms
+
+
+def cachedPageResponse(loader):
+    """
+    Serve a page that is the same for every logged out visitor from the page
+    cache, calling loader to render it if the current version of the
+    dictionary hasn't been cached yet. Pages carry a strong ETag so that
+    browsers which already have the page receive a 304 response.
+    """
+    key = (getDictionaryVersion(), request.full_path)
+
+    def renderPage():
+        body = loader().encode("utf-8")
+        return body, hashlib.sha1(body).hexdigest(), {}
+
+    body, etag, compressed = page_cache.get(key, renderPage)
+    encoding = None
+    if len(body) >= app.config["COMPRESS_MIN_SIZE"]:
+        encoding = chooseEncoding()
+    if encoding:
+        # Each page is compressed once per encoding and kept with the page
+        if encoding not in compressed:
+            compressed[encoding] = compressBody(body, encoding)
+        response = make_response(compressed[encoding])
+        response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag, weak=True)
+    else:
+        response = make_response(body)
+        response.set_etag(etag)
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def getGames():
+    """
+    Return the list of supported games in alphabetical order from the cache.
+    The list is shared between requests and must not be modified.
+    """
+    return games_cache.get(
+        "games", lambda: list(mongo.db.games.find().sort("game_name", 1)))
+
+
+def getGameByName(game_name):
+    """
+    Find a supported game by its name, returning None if there isn't one
+    """
+    for game in getGames():
+        if game["game_name"] == game_name:
+            return game
+    return None
+
+
+def updateGameTermCounts(changes):
+    """
+    Apply changes to the number of definitions each game has, given as a
+    dictionary mapping game IDs to the change in their count. Counts cover
+    every definition, including those hidden from the listings by their
+    rating, as keeping them in step with votes would add a write to every
+    vote that crosses the threshold.
+    """
+    requests = [UpdateOne({"_id": game_id}, {"$inc": {"term_count": change}})
+                for game_id, change in changes.items() if change]
+    if requests:
+        mongo.db.games.bulk_write(requests, ordered=False)
+        games_cache.invalidate()
+
+
+# Letters the dictionary can be browsed by. Definitions that don't start
+# with one of them are listed under "#".
+ALPHABET = tuple("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
+LETTERS = ALPHABET + ("#",)
+
+
+def getTermLetter(term_header):
+    """
+    Return the letter a definition is listed under in the alphabet index
+    """
+    letter = term_header[:1].upper()
+    return letter if letter in ALPHABET else "#"
+
+
+def getLetterCounts():
+    """
+    Return a dictionary mapping each letter to the number of definitions
+    listed under it from the cache. The counts are kept in a single counter
+    document, so no definitions are read to find the letters in use.
+    Like the game counts, they include definitions hidden by their rating,
+    so a letter whose definitions are all hidden is still offered and
+    shows an empty page.
+    """
+    def loadCounts():
+        counter = mongo.db.counters.find_one({"_id": "letters"})
+        return counter.get("counts", {}) if counter else {}
+    return letters_cache.get("counts", loadCounts)
+
+
+def updateLetterCounts(changes):
+    """
+    Apply changes to the number of definitions listed under each letter,
+    given as a dictionary mapping letters to the change in their count
+    """
+    changes = {f"counts.{letter}": change
+               for letter, change in changes.items() if change}
+    if changes:
+        mongo.db.counters.update_one(
+            {"_id": "letters"}, {"$inc": changes}, upsert=True)
+        letters_cache.invalidate()
+
+
+# Fields of the logged in user loaded for each request
+CURRENT_USER_PROJECTION = {"username": 1, "is_admin": 1}
+
+
+def getCurrentUserQuery():
+    """
+    Build the query for the logged in user, or return None if no one is
+    logged in. The session holds the user's ID, so the user is found by
+    primary key. Sessions started before the ID was stored are looked up by
+    username instead.
+    """
+    if not session.get("user"):
+        return None
+    if session.get("user_id"):
+        return {"_id": ObjectId(session["user_id"])}
+    return {"username": session["user"]}
+
+
+def getCurrentUser():
+    """
+    Return the logged in user's ID, username and admin flag, or None if no
+    one is logged in. The user is fetched at most once per request and kept
+    on flask.g for the rest of it.
+    """
+    if "current_user" not in g:
+        query = getCurrentUserQuery()
+        user = query and mongo.db.users.find_one(
+            query, CURRENT_USER_PROJECTION)
+        if user and (session.get("user_id") is None
+                     or session["user"] != user["username"]):
+            # Keep the session up to date if it predates the user's ID or
+            # the username was changed in another session
+            setCurrentUser(user)
+        g.current_user = user or None
+    return g.current_user
+
+
+def setCurrentUser(user):
+    """
+    Store the user in the session as the logged in user, or log the current
+    user out if user is None, forgetting the user loaded for this request
+    """
+    g.pop("current_user", None)
+    if user is None:
+        session.pop("user", None)
+        session.pop("user_id", None)
+    else:
+        session["user"] = user["username"]
+        session["user_id"] = str(user["_id"])
+
+
+def getUsernames(user_ids):
+    """
+    Build a dictionary mapping each of the provided user IDs to its
+    username. Usernames that aren't cached are fetched in a single query.
+    """
+    usernames, missing = username_cache.getMany(set(user_ids))
+    if missing:
+        for user in mongo.db.users.find(
+                {"_id": {"$in": missing}}, {"username": 1}):
+            usernames[user["_id"]] = user["username"]
+            username_cache.set(user["_id"], user["username"])
+    return usernames
+
+
+def encodeCursor(term):
+    """
+    Build an opaque keyset cursor from the sort key of a term. The cursor
+    holds the term header, rating and ID so that pages can be resumed from
+    any term without counting or skipping documents.
+    """
+    key = [term["term_header"], term["rating"], str(term["_id"])]
+    return base64.urlsafe_b64encode(
+        json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decodeCursor(cursor):
+    """
+    Turn a cursor created by encodeCursor back into its sort key. Returns
+    None if the cursor is missing or has been tampered with, including when
+    its values aren't of the types a term has, so they can't be used to pass
+    query operators through to keysetFilter.
+    """
+    if not cursor:
+        return None
+    try:
+        term_header, rating, term_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(term_header, str) or \
+                not isinstance(rating, (int, float)) or \
+                isinstance(rating, bool) or not isinstance(term_id, str):
+            return None
+        return term_header, rating, ObjectId(term_id)
+    except (ValueError, TypeError, binascii.Error, InvalidId):
+        return None
+
+
+def keysetFilter(key, direction):
+    """
+    Build the query that selects terms after (direction 1) or before
+    (direction -1) the provided sort key. Terms are ordered by term_header
+    ascending, then by rating descending, with the ID breaking any ties.
+    """
+    term_header, rating, term_id = key
+    if direction == 1:
+        return {"$or": [
+            {"term_header": {"$gt": term_header}},
+            {"term_header": term_header, "rating": {"$lt": rating}},
+            {"term_header": term_header, "rating": rating,
+             "_id": {"$gt": term_id}}]}
+    return {"$or": [
+        {"term_header": {"$lt": term_header}},
+        {"term_header": term_header, "rating": {"$gt": rating}},
+        {"term_header": term_header, "rating": rating,
+         "_id": {"$lt": term_id}}]}
+
+
+def getPageSize():
+    """
+    Read the requested page size from the query string, falling back to the
+    configured default and never exceeding the configured maximum
+    """
+    try:
+        per_page = int(request.args.get(
+            "per_page", app.config["TERMS_PER_PAGE"]))
+    except ValueError:
+        per_page = app.config["TERMS_PER_PAGE"]
+    return max(1, min(per_page, app.config["MAX_TERMS_PER_PAGE"]))
+
+
+def termsPageQuery(query, after_key=None, before_key=None):
+    """
+    Build the filter and sort order that fetch the terms matching the query
+    after or before the provided sort keys. Pages before a key are fetched
+    in reverse order and flipped by splitTermsPage.
+    """
+    sort_order = [("term_header", 1), ("rating", -1), ("_id", 1)]
+    if before_key:
+        # Walk backwards from the cursor
+        return ({"$and": [query, keysetFilter(before_key, -1)]},
+                [(field, -order) for field, order in sort_order])
+    if after_key:
+        query = {"$and": [query, keysetFilter(after_key, 1)]}
+    return query, sort_order
+
+
+def splitTermsPage(terms, per_page, after_key=None, before_key=None):
+    """
+    Trim the per_page + 1 terms fetched with termsPageQuery down to a page,
+    using the extra term to find out whether another page exists in the
+    direction of travel. Returns the terms for the page along with the
+    cursors for the next and previous pages (None when there is no page).
+    """
+    if before_key:
+        has_prev = len(terms) > per_page
+        terms = terms[:per_page][::-1]
+        has_next = True
+    else:
+        has_next = len(terms) > per_page
+        terms = terms[:per_page]
+        has_prev = after_key is not None
+
+    next_cursor = encodeCursor(terms[-1]) if terms and has_next else None
+    prev_cursor = encodeCursor(terms[0]) if terms and has_prev else None
+    return terms, next_cursor, prev_cursor
+
+
+def getTermsPage(query, after=None, before=None, per_page=None,
+                 projection=None):
+    """
+    Fetch a single page of terms matching the query using keyset pagination.
+    One extra term is requested to find out whether another page exists in
+    the direction of travel. Only the fields in the projection are fetched
+    if one is provided. Returns the terms for the page along with the
+    cursors for the next and previous pages (None when there is no page).
+    """
+    if per_page is None:
+        per_page = app.config["TERMS_PER_PAGE"]
+    after_key = decodeCursor(after)
+    before_key = decodeCursor(before)
+    query, sort_order = termsPageQuery(query, after_key, before_key)
+    terms = list(mongo.db.terms.find(query, projection).sort(
+        sort_order).limit(per_page + 1))
+    return splitTermsPage(terms, per_page, after_key, before_key)
+
+
+def serializeTerm(term):
+    """
+    Convert a term document into a dictionary that can be returned as JSON,
+    with only the fields in PUBLIC_TERM_FIELDS that the term has
+    """
+    serialized = {field: term[field] for field in PUBLIC_TERM_FIELDS
+                  if field in term}
+    for key in ("_id", "game_fk", "submitted_by"):
+        if key in serialized:
+            serialized[key] = str(serialized[key])
+    return serialized
+
+
+def getGameNames(games=None):
+    """
+    Build a dictionary mapping each game's ID to its name, using the
+    provided list of games or the cached list if none is given
+    """
+    if games is None:
+        games = getGames()
+    return {game["_id"]: game["game_name"] for game in games}
+
+
+def resolveTermReferences(terms, game_names=None):
+    """
+    Attach the game name and submitter's username to each of the provided
+    terms so that templates don't need to search the games and users for
+    every term. Only the usernames of the users who submitted these terms
+    are looked up.
+    """
+    terms = list(terms)
+    if game_names is None:
+        game_names = getGameNames()
+    usernames = getUsernames(term["submitted_by"] for term in terms)
+    for term in terms:
+        term["game_name"] = game_names.get(term.get("game_fk"))
+        term["username"] = usernames.get(term.get("submitted_by"))
+    return terms
+
+
+def compileSeparatorPattern(characters):
+    """
+    Compile a pattern matching runs of characters that are not in a set,
+    used to split text into words and the separators between them. Runs of
+    consecutive characters in the set become a single range, which matches
+    far faster than listing every character individually.
+    """
+    code_points = sorted(map(ord, characters))
+    ranges = []
+    start = previous = code_points[0]
+    for code_point in code_points[1:] + [None]:
+        if code_point == previous + 1:
+            previous = code_point
+            continue
+        ranges.append(re.escape(chr(start)) if start == previous else
+                      re.escape(chr(start)) + "-" + re.escape(chr(previous)))
+        start = previous = code_point
+    return re.compile("([^" + "".join(ranges) + "]+)")
+
+
+# better_profanity builds every banned word and its leetspeak variants into
+# a set when it is imported. Adding every prefix of those variants lets text
+# be checked in a single pass over its words, only joining a word with the
+# words after it while the result could still become a banned phrase.
+PROFANE_WORDS = profanity.CENSOR_WORDSET
+PROFANE_PREFIXES = frozenset(
+    word[:length] for word in PROFANE_WORDS for length in range(1, len(word)))
+PROFANE_PHRASE_WORDS = profanity.MAX_NUMBER_COMBINATIONS
+PROFANITY_SEPARATOR_PATTERN = compileSeparatorPattern(ALLOWED_CHARACTERS)
+# Most text is ASCII, which can be split with a much smaller pattern
+ASCII_SEPARATOR_PATTERN = compileSeparatorPattern(
+    char for char in ALLOWED_CHARACTERS if char.isascii())
+
+
+def containsProfanity(text):
+    """
+    Check whether text contains a banned word or leetspeak variant, matching
+    whole words the same way as better_profanity. Words are also joined with
+    the words that follow them, with and without what separates them, to
+    catch banned phrases and words broken up by spaces or punctuation.
+    """
+    if not isinstance(text, str):
+        return False
+    text = text.lower()
+    pattern = (ASCII_SEPARATOR_PATTERN if text.isascii()
+               else PROFANITY_SEPARATOR_PATTERN)
+    # Words are at even positions and the separators between them at odd
+    pieces = pattern.split(text)
+    words = pieces[0::2]
+    if not PROFANE_WORDS.isdisjoint(words):
+        return True
+    for index, word in enumerate(words):
+        if word not in PROFANE_PREFIXES:
+            continue
+        joined = separated = word
+        last = min(len(words), index + 1 + PROFANE_PHRASE_WORDS)
+        for following in range(index + 1, last):
+            next_word = words[following]
+            joined += next_word
+            separated += pieces[2 * following - 1] + next_word
+            if joined in PROFANE_WORDS or separated in PROFANE_WORDS:
+                return True
+            if (joined not in PROFANE_PREFIXES
+                    and separated not in PROFANE_PREFIXES):
+                break
+    return False
+
+
+def tokenizeText(text):
+    """
+    Split text into lowercase words. Missing optional fields are stored as
+    False, so anything that isn't text produces no words.
+    """
+    if not isinstance(text, str):
+        return []
+    return WORD_PATTERN.findall(text.lower())
+
+
+def getTrigrams(word):
+    """
+    Return the set of three letter sequences in a word, padded with spaces so
+    that the start and end of the word are also represented
+    """
+    padded = " " + word + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def buildSearchPostings(term):
+    """
+    Build the search index entries for a term. Each distinct word and
+    trigram in the indexed fields gets one entry, weighted by the most
+    important field it appears in.
+    """
+    weights = {}
+    for field, weight in SEARCH_FIELD_WEIGHTS.items():
+        for word in tokenizeText(term.get(field)):
+            keys = [("word", word)]
+            keys += [("gram", gram) for gram in getTrigrams(word)]
+            for key in keys:
+                weights[key] = max(weights.get(key, 0), weight)
+    return [
+        {"term_id": term["_id"], "kind": kind, "token": token,
+         "weight": weight}
+        for (kind, token), weight in weights.items()]
+
+
+def indexTerm(term):
+    """
+    Add a term to the search index, replacing any entries it already has
+    """
+    mongo.db.search_index.delete_many({"term_id": term["_id"]})
+    postings = buildSearchPostings(term)
+    if postings:
+        mongo.db.search_index.insert_many(postings, ordered=False)
+
+
+def unindexTerms(term_ids):
+    """
+    Remove the provided terms from the search index
+    """
+    mongo.db.search_index.delete_many({"term_id": {"$in": list(term_ids)}})
+
+
+def getWordQuery(word):
+    """
+    Build the search index query for a word. Words of at least
+    SEARCH_MIN_PREFIX letters also match longer words starting with them,
+    while shorter ones only match themselves, as they would be the prefix
+    of a large part of the dictionary.
+    """
+    if len(word) < app.config["SEARCH_MIN_PREFIX"]:
+        return {"kind": "word", "token": word}
+    return {"kind": "word", "token": {"$regex": "^" + re.escape(word)}}
+
+
+def scoreWordMatches(words):
+    """
+    Score terms containing each word, or a word that starts with it. Exact
+    matches are worth twice as much as prefix matches. The postings are
+    combined by the database, which returns only the SEARCH_CANDIDATES
+    strongest matches for each word.
+    """
+    scores = defaultdict(float)
+    for word in words:
+        matches = mongo.db.search_index.aggregate([
+            {"$match": getWordQuery(word)},
+            {"$group": {"_id": "$term_id", "strength": {"$max": {
+                "$multiply": ["$weight", {"$cond": [
+                    {"$eq": ["$token", word]}, 1.0, 0.5]}]}}}},
+            {"$sort": {"strength": -1, "_id": 1}},
+            {"$limit": app.config["SEARCH_CANDIDATES"]}])
+        for match in matches:
+            scores[match["_id"]] += match["strength"]
+    return scores
+
+
+def scoreTrigramMatches(words):
+    """
+    Score terms that share enough trigrams with each word to be considered a
+    close match, catching misspellings and matches in the middle of words.
+    Fuzzy matches are always worth less than word and prefix matches. The
+    database counts the trigrams each term shares and returns only the
+    SEARCH_CANDIDATES closest matches for each word.
+    """
+    scores = defaultdict(float)
+    for word in words:
+        if len(word) < 3:
+            continue
+        grams = getTrigrams(word)
+        matches = mongo.db.search_index.aggregate([
+            {"$match": {"kind": "gram", "token": {"$in": list(grams)}}},
+            {"$group": {"_id": "$term_id", "shared": {"$sum": 1},
+                        "weight": {"$max": "$weight"}}},
+            {"$match": {"shared": {"$gte": TRIGRAM_THRESHOLD * len(grams)}}},
+            {"$sort": {"shared": -1, "weight": -1, "_id": 1}},
+            {"$limit": app.config["SEARCH_CANDIDATES"]}])
+        for match in matches:
+            similarity = match["shared"] / len(grams)
+            scores[match["_id"]] += 0.25 * similarity * match["weight"]
+    return scores
+
+
+def searchTerms(query, limit):
+    """
+    Search the index for terms matching the query. Word and prefix matches
+    are used first, with trigram matches filling any remaining places.
+    Results are ranked by relevance and then by rating, and terms hidden
+    from the dictionary are left out. Returns a list of term documents with
+    their relevance stored under "score".
+    """
+    words = list(dict.fromkeys(tokenizeText(query)))
+    if not words:
+        return []
+    scores = scoreWordMatches(words)
+    if len(scores) < limit:
+        for term_id, score in scoreTrigramMatches(words).items():
+            scores.setdefault(term_id, score)
+
+    # Only fetch ratings for terms that could still make the cut. Terms
+    # tied with the last place are ranked by rating, up to
+    # SEARCH_CANDIDATES of them.
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if len(ranked) > limit:
+        cutoff = scores[ranked[limit - 1]]
+        ranked = [term_id for term_id in ranked if scores[term_id] >= cutoff]
+        ranked = ranked[:max(limit, app.config["SEARCH_CANDIDATES"])]
+    terms = list(mongo.db.terms.find(
+        {"_id": {"$in": ranked}, "rating": {"$gt": -2}}))
+    for term in terms:
+        term["score"] = scores[term["_id"]]
+    terms.sort(key=lambda i: (i["score"], i["rating"]), reverse=True)
+    return terms[:limit]
+
+
+def getSearchLimit():
+    """
+    Read the requested number of search results from the query string,
+    falling back to the configured default and never exceeding the maximum
+    """
+    try:
+        limit = int(request.args.get(
+            "limit", app.config["SEARCH_RESULTS_LIMIT"]))
+    except ValueError:
+        limit = app.config["SEARCH_RESULTS_LIMIT"]
+    return max(1, min(limit, app.config["MAX_SEARCH_RESULTS"]))
+
+
+# Homepage
+@app.route("/")
+@app.route("/get_terms")
+def get_terms():
+    """
+    Displays a page of definitions stored in database alphabetically,
+    provided their current rating is greater than -2. The page is selected
+    with the after/before cursors in the query string. If a search query is
+    provided, the best matching definitions are displayed instead.
+    Logged out visitors are served from the page cache unless they have
+    messages waiting to be displayed.
+    """
+    if "user" not in session and "_flashes" not in session:
+        return cachedPageResponse(renderTermsPage)
+    return renderTermsPage()
+
+
+def renderTermsPage():
+    """
+    Render the dictionary page. If the user is logged in, pass the userID to
+    terms.html as a variable, otherwise display the page without this
+    information.
+    """
+    search_query = request.args.get("q", "").strip()
+    if search_query:
+        # Searches cover the whole dictionary rather than a single page
+        terms = searchTerms(search_query, getSearchLimit())
+        next_cursor = prev_cursor = None
+    else:
+        terms, next_cursor, prev_cursor = getTermsPage(
+            {"rating": {"$gt": -2}},
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            per_page=getPageSize(),
+            projection=LISTING_PROJECTION)
+    return renderTermsTemplate(
+        terms, getGames(), next_cursor, prev_cursor, search_query,
+        getSessionVotes(terms))
+
+
+def getSessionVotes(terms):
+    """
+    Return the logged in user's votes on the provided terms, or no votes if
+    the user isn't logged in
+    """
+    current_user = getCurrentUser()
+    if current_user is None:
+        return {}
+    return getUserVotes(current_user["_id"], terms)
+
+
+def getUserVotesQuery(user_id, terms):
+    """
+    Build the query for a user's votes on the provided terms
+    """
+    return {"term_id": {"$in": [term["_id"] for term in terms]},
+            "user_id": user_id}
+
+
+def getUserVotes(user_id, terms):
+    """
+    Build a dictionary mapping the ID of each of the provided terms that the
+    user has voted on to their vote, 1 for an upvote or -1 for a downvote
+    """
+    if not terms:
+        return {}
+    votes = mongo.db.votes.find(getUserVotesQuery(user_id, terms),
+                                {"_id": 0, "term_id": 1, "vote": 1})
+    return {vote["term_id"]: vote["vote"] for vote in votes}
+
+
+def renderTermsTemplate(terms, games, next_cursor, prev_cursor,
+                        search_query, votes=None, heading="Definitions",
+                        current_game=None, current_letter=None):
+    """
+    Render terms.html for a page of terms that has already been fetched,
+    along with the logged in user's votes on them
+    """
+    terms = renderTermFragments(
+        resolveTermReferences(terms, getGameNames(games)))
+    return render_template(
+        "terms.html", terms=terms, games=games, votes=votes or {},
+        next_cursor=next_cursor, prev_cursor=prev_cursor,
+        search_query=search_query, heading=heading,
+        current_game=current_game, alphabet=LETTERS,
+        letter_counts=getLetterCounts(), current_letter=current_letter)
+
+
+@app.route("/games/<game_name>/terms")
+def game_terms(game_name):
+    """
+    Display a page of the definitions for a single game in alphabetical
+    order, read from an index on the game and term header so that only that
+    game's definitions are fetched. Accepts the same after, before and
+    per_page arguments as get_terms. Logged out visitors are served from the
+    page cache unless they have messages waiting to be displayed.
+    """
+    game = getGameByName(game_name.upper())
+    if game is None:
+        flash("This game is not supported", category="error")
+        return redirect(url_for("get_terms"))
+    if "user" not in session and "_flashes" not in session:
+        return cachedPageResponse(lambda: renderGameTermsPage(game))
+    return renderGameTermsPage(game)
+
+
+def getGameTermsQuery(game):
+    """
+    Build the query for the definitions listed on a game's page
+    """
+    return {"game_fk": game["_id"], "rating": {"$gt": -2}}
+
+
+def renderGameTermsPage(game):
+    """
+    Render a page of a game's definitions, with the user's votes if they are
+    logged in
+    """
+    terms, next_cursor, prev_cursor = getTermsPage(
+        getGameTermsQuery(game),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        per_page=getPageSize(),
+        projection=LISTING_PROJECTION)
+    return renderTermsTemplate(
+        terms, getGames(), next_cursor, prev_cursor, "",
+        getSessionVotes(terms), heading=game["game_name"], current_game=game)
+
+
+@app.route("/terms/letter/<letter>")
+def letter_terms(letter):
+    """
+    Display a page of the definitions listed under a letter in alphabetical
+    order, read from an index on the letter and term header so that only
+    those definitions are fetched. Accepts the same after, before and
+    per_page arguments as get_terms. Logged out visitors are served from the
+    page cache unless they have messages waiting to be displayed.
+    """
+    letter = letter.upper()
+    if letter not in LETTERS:
+        flash("Definitions can only be browsed by letter", category="error")
+        return redirect(url_for("get_terms"))
+    if "user" not in session and "_flashes" not in session:
+        return cachedPageResponse(lambda: renderLetterTermsPage(letter))
+    return renderLetterTermsPage(letter)
+
+
+def getLetterTermsQuery(letter):
+    """
+    Build the query for the definitions listed under a letter
+    """
+    return {"letter": letter, "rating": {"$gt": -2}}
+
+
+def renderLetterTermsPage(letter):
+    """
+    Render a page of the definitions listed under a letter, with the user's
+    votes if they are logged in
+    """
+    terms, next_cursor, prev_cursor = getTermsPage(
+        getLetterTermsQuery(letter),
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        per_page=getPageSize(),
+        projection=LISTING_PROJECTION)
+    return renderTermsTemplate(
+        terms, getGames(), next_cursor, prev_cursor, "",
+        getSessionVotes(terms), heading=letter, current_letter=letter)
+
+
+@app.route("/trending")
+def trending():
+    """
+    Display the definitions that are most popular right now, ranked by their
+    trending score. The feed is read in order from an index on the score,
+    so only the definitions shown are fetched. Logged out visitors are
+    served from the page cache unless they have messages waiting to be
+    displayed.
+    """
+    decayStaleTrendingScores()
+    if "user" not in session and "_flashes" not in session:
+        return cachedPageResponse(renderTrendingPage)
+    return renderTrendingPage()
+
+
+def renderTrendingPage():
+    """
+    Render the trending feed, with the user's votes if they are logged in
+    """
+    terms = list(mongo.db.terms.find(
+        {"rating": {"$gt": -2}}, LISTING_PROJECTION).sort(
+            TRENDING_ORDER).limit(getPageSize()))
+    return renderTermsTemplate(
+        terms, getGames(), None, None, "", getSessionVotes(terms),
+        heading="Trending")
+
+
+@app.route("/get_terms/page")
+@app.route("/api/terms")
+def get_terms_page():
+    """
+    Return a page of definitions as JSON so that the dictionary can be
+    loaded progressively as the user scrolls. Accepts the same after,
+    before and per_page arguments as get_terms.
+    """
+    terms, next_cursor, prev_cursor = getTermsPage(
+        {"rating": {"$gt": -2}},
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        per_page=getPageSize())
+    terms = resolveTermReferences(terms)
+    return jsonify({
+        "terms": [serializeTerm(term) for term in terms],
+        "next": next_cursor,
+        "prev": prev_cursor
+    })
+
+
+@app.route("/search")
+def search():
+    """
+    Search every definition in the dictionary and return the best matches
+    as JSON, ranked by relevance and then rating. The number of results can
+    be set with the limit argument.
+    """
+    terms = resolveTermReferences(searchTerms(
+        request.args.get("q", ""), getSearchLimit()))
+    return jsonify({"terms": [serializeTerm(term) for term in terms]})
+
+
+@app.route("/api/terms/<term_id>")
+def api_term(term_id):
+    """
+    Return a single definition as JSON
+    """
+    try:
+        term = mongo.db.terms.find_one({"_id": ObjectId(term_id)})
+    except InvalidId:
+        term = None
+    if term is None:
+        return jsonify({"error": "This definition does not exist"}), 404
+    return jsonify(serializeTerm(resolveTermReferences([term])[0]))
+
+
+@app.route("/terms/<term_id>/details")
+def term_details(term_id):
+    """
+    Return the rendered details of a definition, which the dictionary page
+    fetches the first time the definition is expanded. The fragment carries
+    an ETag so that browsers revalidate it rather than download it again.
+    """
+    try:
+        term = mongo.db.terms.find_one(
+            {"_id": ObjectId(term_id)}, DETAILS_PROJECTION)
+    except InvalidId:
+        term = None
+    if term is None:
+        return "This definition does not exist", 404
+    term_details = get_template_attribute("term_macros.html", "term_details")
+    response = make_response(term_details(term))
+    response.add_etag()
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@app.route("/api/games")
+def api_games():
+    """
+    Return the list of supported games as JSON
+    """
+    return jsonify({"games": [
+        {"_id": str(game["_id"]), "game_name": game["game_name"]}
+        for game in getGames()]})
+
+
+@app.route("/api/users/<username>")
+def api_user(username):
+    """
+    Return the public details of a user's profile as JSON
+    """
+    user = mongo.db.users.find_one(
+        {"username": username},
+        {"username": 1, "fav_games": 1, "fav_competitors": 1,
+         "total_rating": 1})
+    if user is None:
+        return jsonify({"error": "This user does not exist"}), 404
+    user["_id"] = str(user["_id"])
+    user["term_count"] = mongo.db.terms.count_documents(
+        {"submitted_by": ObjectId(user["_id"]), "rating": {"$gt": -2}})
+    return jsonify(user)
+
+
+def exportTerms(query, fields):
+    """
+    Generate the definitions matching the query as lines of JSON. Terms are
+    read from the cursor in batches and the game names and usernames for
+    each batch are resolved together, so memory use stays the same however
+    many definitions there are.
+    """
+    projection = {EXPORT_FIELDS[field]: 1 for field in fields}
+    cursor = mongo.db.terms.find(query, projection).sort("_id", 1).batch_size(
+        app.config["EXPORT_BATCH_SIZE"])
+    batch = []
+    for term in cursor:
+        batch.append(term)
+        if len(batch) >= app.config["EXPORT_BATCH_SIZE"]:
+            yield encodeExportBatch(batch, fields)
+            batch = []
+    if batch:
+        yield encodeExportBatch(batch, fields)
+
+
+def encodeExportBatch(terms, fields):
+    """
+    Encode a batch of terms as newline delimited JSON with only the
+    requested fields, looking up game names and usernames only if needed
+    """
+    game_names = getGameNames() if "game_name" in fields else {}
+    usernames = {}
+    if "username" in fields:
+        usernames = getUsernames(term["submitted_by"] for term in terms)
+    lines = []
+    for term in terms:
+        term["game_name"] = game_names.get(term.get("game_fk"))
+        term["username"] = usernames.get(term.get("submitted_by"))
+        serialized = serializeTerm(term)
+        lines.append(json.dumps(
+            {field: serialized.get(field) for field in fields}) + "\n")
+    return "".join(lines)
+
+
+@app.route("/api/export/terms")
+def export_terms():
+    """
+    Stream every definition in the dictionary as newline delimited JSON.
+    The fields argument takes a comma separated list of the fields to
+    include and since limits the export to definitions submitted on or
+    after a date (YYYY-MM-DD). The export is compressed as it is streamed
+    if the client accepts it.
+    """
+    fields = list(EXPORT_FIELDS)
+    if request.args.get("fields"):
+        fields = [field.strip() for field in
+                  request.args.get("fields").split(",")]
+        unknown = [field for field in fields if field not in EXPORT_FIELDS]
+        if unknown:
+            return jsonify({"error": "Unknown fields: " +
+                            ", ".join(unknown)}), 400
+
+    query = {}
+    if request.args.get("since"):
+        try:
+            since = datetime.strptime(
+                request.args.get("since").replace("/", "-"), "%Y-%m-%d")
+        except ValueError:
+            return jsonify({"error": "since must be a date in the format "
+                                     "YYYY-MM-DD"}), 400
+        # Dates are stored as YYYY/MM/DD strings, which sort by date
+        query["submission_date"] = {"$gte": since.strftime("%Y/%m/%d")}
+
+    response = Response(
+        stream_with_context(exportTerms(query, fields)),
+        mimetype="application/x-ndjson")
+    response.headers["Content-Disposition"] = (
+        "attachment; filename=terms.ndjson")
+    return response
+
+
+@app.route("/submit_definition", methods=["GET", "POST"])
+def submit_definition():
+    """
+    Check that user is logged in and displays form to submit a definition if
+    so. If not, the user is redirected to homepage with a flash message
+    inviting them to log in or register.
+    Gather data provided in form and insert new definition to database with
+    an upvote from the user who submitted it.
+    """
+    if request.method == "POST":
+        # Check submitted text for profanity
+        if any(containsProfanity(request.form.get(field))
+               for field in DEFINITION_TEXT_FIELDS):
+            flash("Definitions cannot contain profanity. "
+                  "Please reword your submission.", category="error")
+            return redirect(url_for("submit_definition"))
+
+        user = getCurrentUser()
+        if user is None:
+            flash(Markup("Please <a href='login'>"
+                         "login</a> or <a href='register'>"
+                         "register</a> to add a new definition"),
+                  category="error")
+            return redirect(url_for("get_terms"))
+        game = getGameByName(request.form.get("game_name"))
+        today = date.today()
+        submission_date = today.strftime("%Y/%m/%d")
+        term_header = request.form.get("term_header").upper()
+        definition = {
+            "term_header": term_header,
+            "letter": getTermLetter(term_header),
+            "game_fk": game['_id'],
+            "short_definition": request.form.get("short_definition"),
+            "long_description": request.form.get("long_description", False),
+            "youtube_link": request.form.get("youtube_link", False),
+            "submitted_by": user["_id"],
+            "submission_date": submission_date,
+            "rating": 1,
+            "upvotes": 1,
+            "downvotes": 0,
+            **getNewTermTrending()
+        }
+        mongo.db.terms.insert_one(definition)
+        mongo.db.votes.insert_one(
+            {"term_id": definition["_id"], "user_id": user["_id"], "vote": 1})
+        updateGameTermCounts({game["_id"]: 1})
+        updateLetterCounts({definition["letter"]: 1})
+        indexTerm(definition)
+        updateUserRating(definition, 1)
+        bumpDictionaryVersion()
+        flash(f"Thank you, {user['username']}, for your submission",
+              category="success")
+        return redirect(url_for("get_terms"))
+    try:
+        # Ensure that user is logged in before displaying page
+        if session["user"]:
+            return render_template("add_term.html", games=getGames())
+    except KeyError:
+        # Redirect user to homepage if not logged in
+        flash(Markup("Please <a href='login'>"
+                     "login</a> or <a href='register'>"
+                     "register</a> to add a new definition"), category="error")
+        return redirect(url_for("get_terms"))
+
+
+@app.route("/edit_definition/<term_id>", methods=["GET", "POST"])
+def edit_definition(term_id):
+    """
+    Search the database for the term being edited and provide this data to
+    the form when populating. When user submits form, gather the provided data
+    and update the relevant term in the database.
+    """
+    term = mongo.db.terms.find_one({"_id": ObjectId(term_id)})
+    games = getGames()
+    selected_game = getGameByName(request.form.get("game_name"))
+
+    if request.method == "POST":
+        # Check submitted text for profanity
+        if any(containsProfanity(request.form.get(field))
+               for field in DEFINITION_TEXT_FIELDS):
+            flash("Definitions cannot contain profanity. "
+                  "Please reword your changes.", category="error")
+            return redirect(url_for("edit_definition", term_id=term_id))
+
+        if getCurrentUser() is None:
+            flash(Markup("Please <a href='login'>"
+                         "login</a> to edit a definition"), category="error")
+            return redirect(url_for("get_terms"))
+        term_header = request.form.get("term_header").upper()
+        updated = {
+            "term_header": term_header,
+            "letter": getTermLetter(term_header),
+            "game_fk": selected_game['_id'],
+            "short_definition": request.form.get("short_definition"),
+            "long_description": request.form.get("long_description", False),
+            "youtube_link": request.form.get("youtube_link", False)
+        }
+        # Only the edited fields are set, so votes cast while the form was
+        # open aren't overwritten
+        before = mongo.db.terms.find_one_and_update(
+            {"_id": ObjectId(term_id)}, {"$set": updated},
+            projection={"game_fk": 1, "term_header": 1})
+        if before and before.get("game_fk") != updated["game_fk"]:
+            updateGameTermCounts(
+                {before.get("game_fk"): -1, updated["game_fk"]: 1})
+        if before:
+            letter = getTermLetter(before["term_header"])
+            if letter != updated["letter"]:
+                updateLetterCounts({letter: -1, updated["letter"]: 1})
+        indexTerm(dict(term, **updated))
+        bumpDictionaryVersion()
+        flash("Term successfully updated", category="success")
+        return redirect(url_for("get_terms"))
+
+    # Check that user is logged in or is an admin
+    user = getCurrentUser()
+    if user is None:
+        # Redirect user to homepage if not logged in
+        flash(Markup("Please <a href='login'>"
+                     "login</a> to edit a definition"), category="error")
+        return redirect(url_for("get_terms"))
+    is_admin = True if "admin" in session else False
+    if user["_id"] == term["submitted_by"] or is_admin:
+        return render_template(
+            "edit_term.html", term=term, games=games, user=user)
+    else:
+        flash("You cannot edit a term that you did not submit",
+              category="error")
+        return redirect(url_for("get_terms"))
+
+
+@app.route("/delete_definition/<term_id>")
+def delete_definition(term_id):
+    """
+    Check that user is logged in and is the original poster of the term or is
+    an Admin. Search the database for the term being deleted and remove it.
+    """
+    term = mongo.db.terms.find_one({"_id": ObjectId(term_id)})
+    user = getCurrentUser()
+    if user is None:
+        flash(Markup("Please <a href='login'>"
+                     "login</a> to delete a definition"), category="error")
+        return redirect(url_for("get_terms"))
+    is_admin = True if "admin" in session else False
+    if user["_id"] == term["submitted_by"] or is_admin:
+        updateUserRating(term, - term["rating"])
+        if vote_buffer is not None:
+            vote_buffer.discard(term["_id"], term["submitted_by"])
+        deleted = mongo.db.terms.delete_one({"_id": ObjectId(term_id)})
+        if deleted.deleted_count:
+            updateGameTermCounts({term.get("game_fk"): -1})
+            updateLetterCounts({getTermLetter(term["term_header"]): -1})
+        mongo.db.votes.delete_many({"term_id": ObjectId(term_id)})
+        unindexTerms([ObjectId(term_id)])
+        bumpDictionaryVersion()
+        flash("Term successfully deleted", category="success")
+        return redirect(url_for("get_terms"))
+    else:
+        flash("You cannot delete a term that you did not submit",
+              category="error")
+        return redirect(url_for("get_terms"))
+
+
+class VoteBuffer:
+    """
+    Collects the changes votes make to terms and their submitters and writes
+    them to the database in bulk, so that a term receiving many votes has
+    its rating, vote counters and trending score, and its submitter's total
+    rating, updated once per flush instead of once per vote. Flushes happen
+    every flush_interval seconds, or sooner once flush_threshold changes are
+    waiting. Only the rating changes are kept in memory, to report a term's
+    rating before it is written. The rest are read back from the spill file
+    when it is flushed.
+
+    Every change is also appended to a spill file before it is acknowledged,
+    and replayed from there on startup so pending changes survive the
+    process crashing. The spill file is flushed but not synced to disk for
+    each vote, so changes from the last moments before the host itself
+    crashes can be lost.
+
+    Each spill file starts with the ID of the batch its changes will be
+    written as. A flush renames the spill file to the batch file in one
+    step and starts a new spill file, so a change is never in both. Every
+    updated document remembers the IDs of its most recent batches, so a
+    batch that was interrupted part way through can be retried without
+    being applied twice.
+    """
+
+    def __init__(self, spill_path, flush_interval, flush_threshold):
+        self.spill_path = spill_path
+        self.batch_path = spill_path + ".flushing"
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.term_changes = defaultdict(int)
+        self.author_changes = defaultdict(int)
+        self.pending = 0
+        self.thread = None
+        self.recover()
+        self.openSpill()
+
+    def openSpill(self):
+        """
+        Open the spill file for appending, starting a new one headed by the
+        ID of the next batch if there isn't one
+        """
+        self.spill = open(self.spill_path, "a")
+        if self.spill.tell() == 0:
+            self.spill.write(json.dumps({"batch": str(ObjectId())}) + "\n")
+            self.spill.flush()
+            os.fsync(self.spill.fileno())
+
+    def recover(self):
+        """
+        Reload changes left in the spill file by a previous process. The
+        file is written again without any line left incomplete by the
+        process dying, so that new changes start on a line of their own,
+        and with a batch ID if it was written before they were kept.
+        """
+        if not os.path.exists(self.spill_path):
+            return
+        batch_id, changes = self.readChanges(self.spill_path)
+        for change in changes:
+            self.record(ObjectId(change["term"]),
+                        ObjectId(change["author"]), change["change"])
+        with open(self.spill_path + ".tmp", "w") as spill:
+            spill.write(json.dumps(
+                {"batch": batch_id or str(ObjectId())}) + "\n")
+            for change in changes:
+                spill.write(json.dumps(change) + "\n")
+            spill.flush()
+            os.fsync(spill.fileno())
+        os.replace(self.spill_path + ".tmp", self.spill_path)
+
+    @staticmethod
+    def readChanges(path):
+        """
+        Read a spill or batch file, returning its batch ID and changes
+        """
+        batch_id = None
+        changes = []
+        with open(path) as spill:
+            for line in spill:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # The last line may be incomplete if the process died
+                    continue
+                if "batch" in change:
+                    batch_id = change["batch"]
+                elif "id" in change:
+                    # A batch file written before batches were spill files
+                    batch_id = change["id"]
+                    changes += [{"term": term_id, "change": amount}
+                                for term_id, amount in change["terms"].items()]
+                    changes += [
+                        {"author": author_id, "change": amount}
+                        for author_id, amount in change["authors"].items()]
+                else:
+                    changes.append(change)
+        return batch_id, changes
+
+    def record(self, term_id, author_id, change):
+        self.term_changes[term_id] += change
+        self.author_changes[author_id] += change
+        self.pending += 1
+
+    def add(self, term_id, author_id, changes):
+        """
+        Queue the changes a vote makes to a term's rating and vote counters,
+        as returned by settleVote, and to its submitter's total rating. The
+        vote's time is kept to add it to the term's trending score. Returns
+        the change to the term's rating that is still waiting to be written.
+        """
+        with self.lock:
+            self.spill.write(json.dumps({
+                "term": str(term_id), "author": str(author_id),
+                "change": changes["rating"],
+                "upvotes": changes.get("upvotes", 0),
+                "downvotes": changes.get("downvotes", 0),
+                "at": datetime.utcnow().isoformat()}) + "\n")
+            self.spill.flush()
+            self.record(term_id, author_id, changes["rating"])
+            pending_change = self.term_changes[term_id]
+            if self.pending >= self.flush_threshold:
+                self.wake.set()
+        self.start()
+        return pending_change
+
+    def discard(self, term_id, author_id):
+        """
+        Drop the waiting change for a term that is being deleted, along with
+        its share of the submitter's change
+        """
+        with self.lock:
+            change = self.term_changes.get(term_id, 0)
+        if change:
+            self.add(term_id, author_id, {"rating": -change})
+
+    def start(self):
+        """
+        Start the background thread that flushes changes, if not running
+        """
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self.run, name="vote-buffer", daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as error:
+                # Changes stay in the batch file and are retried next time
+                app.logger.error("Failed to flush vote buffer: %s", error)
+
+    def flush(self):
+        """
+        Write every waiting change to the database with one bulk write per
+        collection. A batch left behind by a failed flush is retried first.
+        """
+        with self.flush_lock:
+            if os.path.exists(self.batch_path):
+                self.writeBatch()
+            with self.lock:
+                if not self.pending:
+                    return
+                os.fsync(self.spill.fileno())
+                self.spill.close()
+                os.replace(self.spill_path, self.batch_path)
+                self.openSpill()
+                self.term_changes.clear()
+                self.author_changes.clear()
+                self.pending = 0
+            self.writeBatch()
+
+    def writeBatch(self):
+        """
+        Apply the changes in the batch file and remove the file. Each
+        document records the IDs of its most recent batches so that
+        retrying a batch skips the documents it has already updated.
+        """
+        batch_id, changes = self.readChanges(self.batch_path)
+        batch_id = ObjectId(batch_id)
+        epoch = getTrendingEpoch()
+        terms = defaultdict(lambda: {
+            "rating": 0, "upvotes": 0, "downvotes": 0, "trending": 0})
+        authors = defaultdict(int)
+        for change in changes:
+            if "term" in change:
+                term = terms[change["term"]]
+                term["rating"] += change["change"]
+                # Changes queued before the counters were buffered only
+                # changed the rating
+                term["upvotes"] += change.get("upvotes", 0)
+                term["downvotes"] += change.get("downvotes", 0)
+                if "at" in change:
+                    term["trending"] += change["change"] * getTrendingWeight(
+                        datetime.fromisoformat(change["at"]), epoch)
+            if "author" in change:
+                authors[change["author"]] += change["change"]
+
+        term_requests = []
+        for term_id, term in terms.items():
+            trending = term.pop("trending")
+            if not any(term.values()) and not trending:
+                continue
+            update = buildTermVoteUpdate(term, trending, epoch)
+            update[0]["$set"]["vote_batches"] = {"$slice": [
+                {"$concatArrays": [{"$ifNull": ["$vote_batches", []]},
+                                   [batch_id]]}, -10]}
+            term_requests.append(UpdateOne(
+                {"_id": ObjectId(term_id), "vote_batches": {"$ne": batch_id}},
+                update))
+        author_requests = [UpdateOne(
+            {"_id": ObjectId(author_id), "vote_batches": {"$ne": batch_id}},
+            {"$inc": {"total_rating": change},
+             "$push": {"vote_batches": {"$each": [batch_id], "$slice": -10}}})
+            for author_id, change in authors.items() if change]
+        if term_requests:
+            mongo.db.terms.bulk_write(term_requests, ordered=False)
+        if author_requests:
+            mongo.db.users.bulk_write(author_requests, ordered=False)
+        os.remove(self.batch_path)
+        bumpDictionaryVersion()
+
+
+# Buffer the changes votes make when write-behind mode is enabled
+vote_buffer = None
+if app.config["VOTE_WRITE_BEHIND"]:
+    vote_buffer = VoteBuffer(
+        app.config["VOTE_SPILL_PATH"],
+        app.config["VOTE_FLUSH_INTERVAL"],
+        app.config["VOTE_FLUSH_THRESHOLD"])
+    atexit.register(vote_buffer.flush)
+
+
+def buildVotePipeline(direction):
+    """
+    Build an update pipeline that applies a user's vote to their document in
+    the votes collection in a single atomic write. Voting in the same
+    direction as an existing vote takes it back, leaving a vote of 0,
+    voting in the opposite direction replaces it. Upserting the pipeline
+    creates the document for a user's first vote on a term.
+    """
+    return [{"$set": {"vote": {"$cond": [
+        {"$eq": ["$vote", direction]}, 0, direction]}}}]
+
+
+def settleVote(before, direction):
+    """
+    Work out the user's vote (1, -1 or 0 if the vote was taken back) and the
+    changes to the term's rating and vote counters, from the user's vote
+    document as it was before the vote
+    """
+    previous = before["vote"] if before else 0
+    vote = 0 if previous == direction else direction
+    return vote, {
+        "rating": vote - previous,
+        "upvotes": (vote == 1) - (previous == 1),
+        "downvotes": (vote == -1) - (previous == -1)}
+
+
+# Order of the trending feed
+TRENDING_ORDER = [("trending_score", -1), ("_id", 1)]
+UNIX_EPOCH = datetime(1970, 1, 1)
+# The latest epoch this process has brought every trending score forward to
+trending_decayed_epoch = None
+
+
+def getTrendingEpoch(now=None):
+    """
+    Return the start of the trending epoch containing now. Trending scores
+    are stored relative to the start of an epoch, which lets votes be added
+    to them without reading them first and lets every score be compared
+    without decaying each one to the current time.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    period = timedelta(hours=app.config["TRENDING_EPOCH_HOURS"])
+    return UNIX_EPOCH + (now - UNIX_EPOCH) // period * period
+
+
+def getTrendingWeight(when, epoch):
+    """
+    Return how much a rating point gained at a given time adds to a trending
+    score stored relative to the epoch. Points are worth twice as much for
+    every TRENDING_HALF_LIFE_HOURS that pass, which is the same as older
+    points losing half their value over that time.
+    """
+    half_life = timedelta(hours=app.config["TRENDING_HALF_LIFE_HOURS"])
+    return 2 ** ((when - epoch) / half_life)
+
+
+def getTrendingDecay(epoch):
+    """
+    Build the expression that brings a term's trending score forward from
+    the epoch it is stored relative to, to the provided epoch
+    """
+    half_life_ms = app.config["TRENDING_HALF_LIFE_HOURS"] * 3600000
+    return {"$pow": [0.5, {"$divide": [
+        {"$subtract": [epoch, {"$ifNull": ["$trending_epoch", epoch]}]},
+        half_life_ms]}]}
+
+
+def getNewTermTrending(when=None):
+    """
+    Return the trending fields for a term submitted with one upvote
+    """
+    when = when or datetime.utcnow()
+    epoch = getTrendingEpoch(when)
+    return {"trending_score": getTrendingWeight(when, epoch),
+            "trending_epoch": epoch}
 
-# Add PyMongo
-mongo = PyMongo(app)
 
+def buildTermVoteUpdate(changes, trending, epoch):
+    """
+    Build the update pipeline that applies the changes of one or more votes
+    to a term's counters and adds trending, a score relative to the epoch,
+    to the term's trending score, bringing the score forward to the epoch
+    first
+    """
+    update = {field: {"$add": [{"$ifNull": ["$" + field, 0]}, change]}
+              for field, change in changes.items()}
+    update["trending_score"] = {"$add": [
+        {"$multiply": [{"$ifNull": ["$trending_score", 0]},
+                       getTrendingDecay(epoch)]},
+        trending]}
+    update["trending_epoch"] = epoch
+    return [{"$set": update}]
 
-# Homepage
-@app.route("/")
-@app.route("/get_terms")
-def get_terms():
+
+def decayTrendingScores():
     """
-    Displays definitions stored in database alphabetically, provided their
-    current rating is greater than -2. If the user is logged in, pass the
-    userID to terms.html as a variable, otherwise display the page without
-    this information.
+    Bring every term's trending score forward to the current epoch, so that
+    terms nobody has voted on lately fall down the trending feed. Terms
+    without a score are given one from their rating, as if every vote had
+    been cast on the day they were submitted. Returns the number of terms
+    updated.
     """
-    try:
-        # Check if user is logged in
-        if session["user"]:
-            terms = mongo.db.terms.find({"rating": {"$gt": -2}}).sort(
-                    [("term_header", 1),
-                        ("rating", -1)])
-            games = list(mongo.db.games.find().sort("game_name", 1))
-            users = list(mongo.db.users.find())
-            current_user = mongo.db.users.find_one(
-                {"username": session["user"]})
-            userid = current_user["_id"]
-            return render_template(
-                "terms.html",
-                terms=terms, games=games, users=users, userid=userid)
-    except KeyError:
-        # User is not logged in and doesn't have session cookie set
-        terms = mongo.db.terms.find({"rating": {"$gt": -2}}).sort(
-                    [("term_header", 1),
-                        ("rating", -1)])
-        games = list(mongo.db.games.find().sort("game_name", 1))
-        users = list(mongo.db.users.find())
-        return render_template(
-            "terms.html", terms=terms, games=games, users=users)
+    epoch = getTrendingEpoch()
+    half_life_ms = app.config["TRENDING_HALF_LIFE_HOURS"] * 3600000
+    decayed = mongo.db.terms.update_many(
+        {"trending_epoch": {"$lt": epoch}},
+        [{"$set": {
+            "trending_score": {"$multiply": [
+                "$trending_score", getTrendingDecay(epoch)]},
+            "trending_epoch": epoch}}])
+    submitted = {"$dateFromString": {
+        "dateString": "$submission_date", "format": "%Y/%m/%d",
+        "onError": epoch, "onNull": epoch}}
+    scored = mongo.db.terms.update_many(
+        {"trending_epoch": {"$exists": False}},
+        [{"$set": {
+            "trending_score": {"$multiply": ["$rating", {"$pow": [
+                2, {"$divide": [{"$subtract": [submitted, epoch]},
+                                half_life_ms]}]}]},
+            "trending_epoch": epoch}}])
+    count = decayed.modified_count + scored.modified_count
+    if count:
+        bumpDictionaryVersion()
+    return count
+
+
+def decayStaleTrendingScores():
+    """
+    Decay trending scores if any are still stored relative to an earlier
+    epoch. Scores stored relative to different epochs can't be compared, so
+    the feed can't be read until terms nobody has voted on since the epoch
+    began have been brought forward. Each process checks once per epoch,
+    using the index on trending_epoch.
+    """
+    global trending_decayed_epoch
+    epoch = getTrendingEpoch()
+    if trending_decayed_epoch == epoch:
+        return
+    if mongo.db.terms.find_one(
+            {"trending_epoch": {"$lt": epoch}}, {"_id": 1}) is not None:
+        decayTrendingScores()
+    trending_decayed_epoch = epoch
 
 
-@app.route("/submit_definition", methods=["GET", "POST"])
-def submit_definition():
+def getSecondsToNextEpoch():
     """
-    Check that user is logged in and displays form to submit a definition if
-    so. If not, the user is redirected to homepage with a flash message
-    inviting them to log in or register.
-    Gather data provided in form and insert new definition to database with
-    the user added as a user who has upvoted the term.
+    Return the number of seconds until the next trending epoch begins
     """
-    if request.method == "POST":
-        game = mongo.db.games.find_one(
-            {"game_name": request.form.get("game_name")})
-        user = mongo.db.users.find_one({"username": session["user"]})
-        today = date.today()
-        submission_date = today.strftime("%Y/%m/%d")
-        definition = {
-            "term_header": request.form.get("term_header").upper(),
-            "game_fk": game['_id'],
-            "short_definition": request.form.get("short_definition"),
-            "long_description": request.form.get("long_description", False),
-            "youtube_link": request.form.get("youtube_link", False),
-            "submitted_by": user["_id"],
-            "submission_date": submission_date,
-            "rating": 1,
-            "upvoted_by": [user["_id"]],
-            "downvoted_by": []
-        }
-        mongo.db.terms.insert_one(definition)
-        updateUserRating(definition, 1)
-        flash(f"Thank you, {session['user']}, for your submission",
-              category="success")
-        return redirect(url_for("get_terms"))
-    try:
-        # Ensure that user is logged in before displaying page
-        if session["user"]:
-            games = mongo.db.games.find().sort("game_name", 1)
-            return render_template("add_term.html", games=games)
-    except KeyError:
-        # Redirect user to homepage if not logged in
-        flash(Markup("Please <a href='login'>"
-                     "login</a> or <a href='register'>"
-                     "register</a> to add a new definition"), category="error")
-        return redirect(url_for("get_terms"))
+    now = datetime.utcnow()
+    period = timedelta(hours=app.config["TRENDING_EPOCH_HOURS"])
+    return (getTrendingEpoch(now) + period - now).total_seconds()
 
 
-@app.route("/edit_definition/<term_id>", methods=["GET", "POST"])
-def edit_definition(term_id):
+def runTrendingDecay():
+    while True:
+        try:
+            decayStaleTrendingScores()
+        except PyMongoError as error:
+            app.logger.error("Failed to decay trending scores: %s", error)
+        # Wake just after the next epoch begins, or sooner to retry a failure
+        time.sleep(min(app.config["TRENDING_DECAY_INTERVAL"],
+                       getSecondsToNextEpoch() + 1))
+
+
+@app.before_first_request
+def startTrendingDecay():
     """
-    Search the database for the term being edited and provide this data to
-    the form when populating. When user submits form, gather the provided data
-    and update the relevant term in the database.
+    Decay trending scores in the background when the app starts and as each
+    epoch begins, checking at least every TRENDING_DECAY_INTERVAL seconds.
+    Decaying is idempotent, so it is safe for every process to do it. Set
+    the interval to 0 to leave it to the trending feed, which decays the
+    scores the first time it is read in a new epoch, and the decay-trending
+    command.
     """
-    term = mongo.db.terms.find_one({"_id": ObjectId(term_id)})
-    games = mongo.db.games.find().sort("game_name", 1)
-    selected_game = mongo.db.games.find_one(
-            {"game_name": request.form.get("game_name")})
+    if app.config["TRENDING_DECAY_INTERVAL"] > 0:
+        threading.Thread(target=runTrendingDecay, name="trending-decay",
+                         daemon=True).start()
+
+
+def dbStep(collection, method, *args, **kwargs):
+    """
+    Describe a database operation for a step generator such as voteSteps to
+    yield, as the collection, the name of the method to call on it and the
+    arguments to call it with
+    """
+    return collection, method, args, kwargs
 
-    if request.method == "POST":
-        user = mongo.db.users.find_one({"username": session["user"]})
-        updated = {
-            "term_header": request.form.get("term_header").upper(),
-            "game_fk": selected_game['_id'],
-            "short_definition": request.form.get("short_definition"),
-            "long_description": request.form.get("long_description", False),
-            "youtube_link": request.form.get("youtube_link", False),
-            "submitted_by": term["submitted_by"],
-            "submission_date": term["submission_date"],
-            "rating": term["rating"],
-            "upvoted_by": term["upvoted_by"],
-            "downvoted_by": term["downvoted_by"]
-        }
-        mongo.db.terms.update({"_id": ObjectId(term_id)}, updated)
-        flash("Term successfully updated", category="success")
-        return redirect(url_for("get_terms"))
 
+def runSteps(steps):
+    """
+    Run the database operations yielded by a step generator with pymongo,
+    sending each result back, and return what the generator returns. An
+    operation that fails is raised inside the generator, so that it can
+    undo what it has already done.
+    """
+    resume, value = steps.send, None
     try:
-        # Check that user is logged in or is an admin
-        user = mongo.db.users.find_one({"username": session["user"]})
-        is_admin = True if "admin" in session else False
-        if user["_id"] == term["submitted_by"] or is_admin:
-            return render_template(
-                "edit_term.html", term=term, games=games, user=user)
-        else:
-            flash("You cannot edit a term that you did not submit",
-                  category="error")
-            return redirect(url_for("get_terms"))
-    except KeyError:
-        # Redirect user to homepage if not logged in
-        flash(Markup("Please <a href='login'>"
-                     "login</a> to edit a definition"), category="error")
-        return redirect(url_for("get_terms"))
+        while True:
+            collection, method, args, kwargs = resume(value)
+            try:
+                value = getattr(mongo.db[collection], method)(*args, **kwargs)
+                resume = steps.send
+            except PyMongoError as error:
+                resume, value = steps.throw, error
+    except StopIteration as stop:
+        return stop.value
 
 
-@app.route("/delete_definition/<term_id>")
-def delete_definition(term_id):
+def voteSteps(term_id, user_id, direction):
     """
-    Check that user is logged in and is the original poster of the term or is
-    an Admin. Search the database for the term being deleted and remove it.
+    Apply an upvote (direction 1) or downvote (direction -1) from a user to a
+    term, adjusting the rating of the user who submitted it to match. The
+    user's vote is updated atomically and its previous value returned, which
+    gives the changes to apply to the term's counters, its trending score
+    and the submitter. Returns the term's new rating and the user's vote (1,
+    -1 or 0 if the vote was taken back), or None if the term doesn't exist.
+    If the term can't be updated, the user's vote is put back as it was
+    before the error is raised.
+    The database operations are yielded for runSteps, or the ASGI app's
+    Motor equivalent, to run, so that both apps apply votes the same way.
     """
-    term = mongo.db.terms.find_one({"_id": ObjectId(term_id)})
+    if vote_buffer is not None:
+        return (yield from bufferedVoteSteps(term_id, user_id, direction))
+    key = {"term_id": term_id, "user_id": user_id}
+    before = yield dbStep(
+        "votes", "find_one_and_update", key, buildVotePipeline(direction),
+        upsert=True, return_document=ReturnDocument.BEFORE)
+    vote, changes = settleVote(before, direction)
+    now = datetime.utcnow()
+    epoch = getTrendingEpoch(now)
+    trending = changes["rating"] * getTrendingWeight(now, epoch)
     try:
-        user = mongo.db.users.find_one({"username": session["user"]})
-        updateUserRating(term, - term["rating"])
-        is_admin = True if "admin" in session else False
-        if user["_id"] == term["submitted_by"] or is_admin:
-            mongo.db.terms.remove({"_id": ObjectId(term_id)})
-            flash("Term successfully deleted", category="success")
-            return redirect(url_for("get_terms"))
+        term = yield dbStep(
+            "terms", "find_one_and_update",
+            {"_id": term_id}, buildTermVoteUpdate(changes, trending, epoch),
+            projection={"rating": 1, "submitted_by": 1},
+            return_document=ReturnDocument.AFTER)
+    except PyMongoError:
+        # The vote and the term's counters aren't written together, so take
+        # the vote back rather than leave it uncounted. It is only restored
+        # if the user hasn't voted again since.
+        if before is None:
+            yield dbStep("votes", "delete_one", dict(key, vote=vote))
         else:
-            flash("You cannot delete a term that you did not submit",
-                  category="error")
-            return redirect(url_for("get_terms"))
-    except KeyError:
-        flash(Markup("Please <a href='login'>"
-                     "login</a> to delete a definition"), category="error")
-        return redirect(url_for("get_terms"))
+            yield dbStep("votes", "update_one", dict(key, vote=vote),
+                         {"$set": {"vote": before["vote"]}})
+        raise
+    if term is None:
+        # Votes can't be kept for a term that doesn't exist
+        yield dbStep("votes", "delete_one", key)
+        return None
+    if vote == 0:
+        # Don't keep votes that have been taken back
+        yield dbStep("votes", "delete_one", dict(key, vote=0))
+    if changes["rating"]:
+        yield dbStep("users", "update_one", {"_id": term["submitted_by"]},
+                     {"$inc": {"total_rating": changes["rating"]}})
+    return {"rating": term["rating"], "vote": vote}
+
+
+def bufferedVoteSteps(term_id, user_id, direction):
+    """
+    Apply a vote in write-behind mode. Only the user's vote is written; the
+    term is read, not written, and the changes to its counters, trending
+    score and submitter are queued in the vote buffer, so a popular term is
+    written once per flush however many votes it receives. Returns the same
+    as voteSteps, with the term's rating including changes not yet written.
+    """
+    term = yield dbStep("terms", "find_one", {"_id": term_id},
+                        {"rating": 1, "submitted_by": 1})
+    if term is None:
+        return None
+    key = {"term_id": term_id, "user_id": user_id}
+    before = yield dbStep(
+        "votes", "find_one_and_update", key, buildVotePipeline(direction),
+        upsert=True, return_document=ReturnDocument.BEFORE)
+    vote, changes = settleVote(before, direction)
+    if vote == 0:
+        # Don't keep votes that have been taken back
+        yield dbStep("votes", "delete_one", dict(key, vote=0))
+    pending_change = vote_buffer.add(term_id, term["submitted_by"], changes)
+    return {"rating": term["rating"] + pending_change, "vote": vote}
+
+
+def applyVote(term_id, user_id, direction):
+    """
+    Apply a vote from a user to a term with voteSteps, returning the term's
+    new rating and the user's vote, or None if the term doesn't exist
+    """
+    return runSteps(voteSteps(term_id, user_id, direction))
+
+
+# Errors returned to the vote buttons, by status code
+VOTE_ERRORS = {
+    401: "Please log in to rate definitions",
+    404: "This definition does not exist"
+}
+
+
+def voteError(status):
+    """
+    Return the JSON error for a vote that couldn't be applied
+    """
+    return jsonify({"error": VOTE_ERRORS[status]}), status
+
+
+def castVote(term_id, direction):
+    """
+    Apply a vote from the logged in user and return the term's new rating
+    and the user's vote state as JSON
+    """
+    user = getCurrentUser()
+    if user is None:
+        return voteError(401)
+    try:
+        result = applyVote(ObjectId(term_id), user["_id"], direction)
+    except InvalidId:
+        result = None
+    if result is None:
+        return voteError(404)
+    if vote_buffer is None:
+        # Buffered ratings change the dictionary when they are flushed
+        bumpDictionaryVersion()
+    return jsonify(result)
 
 
 @app.route("/upvote/<term_id>/<username>", methods=["GET", "POST"])
 def upvote(term_id, username):
     """
-    Gather data related to the username and the term ID provided. Check if the
-    user has not previously upvoted the definition. If not, check if the user
-    has previously downvoted the definition. Based on the results of these
-    checks, reduce the rating by 1 (if they have upvoted before), increase the
-    rating by 1 (if they have not rated the definition), or increase by 2 (if
-    they have previously downvoted as this cancels out their original downvote
-    and applies an upvote).
+    Apply an upvote from the logged in user to the definition. If the user
+    has previously upvoted the definition the upvote is taken back, reducing
+    the rating by 1. If they have not rated the definition the rating is
+    increased by 1, and if they have previously downvoted it the rating is
+    increased by 2 as this cancels out their original downvote and applies
+    an upvote.
     """
     if request.method == "POST":
-        user = mongo.db.users.find_one({"username": session["user"]})
-        term = dict(mongo.db.terms.find_one({"_id": ObjectId(term_id)}))
-        upvoted_array = list(term.get("upvoted_by", []))
-        downvoted_array = list(term.get("downvoted_by", []))
-        # check if user has not upvoted term
-        if user["_id"] not in upvoted_array:
-            """
-            Check if user has previously downvoted term. If so, cancel out the
-            downvote by increasing rating by 2, remove userID from list of
-            users who have downvoted term, and add userID to list of users
-            who have upvoted term
-            """
-            if user["_id"] in downvoted_array:
-                try:
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)}, {"$inc": {"rating": 2}})
-                    updateUserRating(term, 2)
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$pull": {"downvoted_by": user["_id"]}})
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$push": {"upvoted_by": user["_id"]}})
-                    return "nothing"
-                except TypeError:
-                    pass
-            else:
-                """
-                User has not downvoted term. Increase rating by 1 and add
-                userID to list of users who have upvoted term
-                """
-                try:
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)}, {"$inc": {"rating": 1}})
-                    updateUserRating(term, 1)
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$push": {"upvoted_by": user["_id"]}})
-                    return "nothing"
-                except TypeError:
-                    pass
-        else:
-            # User has upvoted term and upvote should be taken back
-            try:
-                mongo.db.terms.update_one(
-                    {"_id": ObjectId(term_id)}, {"$inc": {"rating": -1}})
-                updateUserRating(term, -1)
-                mongo.db.terms.update_one(
-                    {"_id": ObjectId(term_id)},
-                    {"$pull": {"upvoted_by": user["_id"]}})
-                return "nothing"
-            except TypeError:
-                pass
+        return castVote(term_id, 1)
     return redirect(url_for("get_terms"))
 
 
 @app.route("/downvote/<term_id>/<username>", methods=["GET", "POST"])
 def downvote(term_id, username):
     """
-    Gather data related to the username and the term ID provided. Check if the
-    user has not previously downvoted the definition. If not, check if the user
-    has previously upvoted the definition. Based on the results of these
-    checks, increase the rating by 1 (if they have downvoted before), decrease
-    the rating by 1 (if they have not rated the definition), or decrease by 2
-    (if they have previously upvoted as this cancels out their original upvote
-    and applies a downvote).
+    Apply a downvote from the logged in user to the definition. If the user
+    has previously downvoted the definition the downvote is taken back,
+    increasing the rating by 1. If they have not rated the definition the
+    rating is decreased by 1, and if they have previously upvoted it the
+    rating is decreased by 2 as this cancels out their original upvote and
+    applies a downvote.
     """
     if request.method == "POST":
-        user = mongo.db.users.find_one({"username": session["user"]})
-        term = dict(mongo.db.terms.find_one({"_id": ObjectId(term_id)}))
-        upvoted_array = list(term.get("upvoted_by", []))
-        downvoted_array = list(term.get("downvoted_by", []))
-        # Check if user has not downvoted term
-        if user["_id"] not in downvoted_array:
-            """
-            Check if user has previously upvoted term. If so, cancel out the
-            upvote by decreasing rating by 2, remove userID from list of users
-            who have upvoted term, and add userID to list of users who have
-            downvoted term
-            """
-            if user["_id"] in upvoted_array:
-                try:
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)}, {"$inc": {"rating": -2}})
-                    updateUserRating(term, -2)
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$pull": {"upvoted_by": user["_id"]}})
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$push": {"downvoted_by": user["_id"]}})
-                    return "nothing"
-                except TypeError:
-                    pass
-            else:
-                """
-                User has not upvoted term. Decrease rating by 1 and add userID
-                to list of users who have downvoted term
-                """
-                try:
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)}, {"$inc": {"rating": -1}})
-                    updateUserRating(term, -1)
-                    mongo.db.terms.update_one(
-                        {"_id": ObjectId(term_id)},
-                        {"$push": {"downvoted_by": user["_id"]}})
-                    return "nothing"
-                except TypeError:
-                    pass
-        else:
-            # User has downvoted term and downvote should be taken back
-            try:
-                mongo.db.terms.update_one(
-                    {"_id": ObjectId(term_id)}, {"$inc": {"rating": 1}})
-                updateUserRating(term, 1)
-                mongo.db.terms.update_one(
-                    {"_id": ObjectId(term_id)},
-                    {"$pull": {"downvoted_by": user["_id"]}})
-                return "nothing"
-            except TypeError:
-                pass
+        return castVote(term_id, -1)
     return redirect(url_for("get_terms"))
 
 
-def sortTermsAlphabetically(terms):
-    """
-    Sort provided list of terms alphabetically and then by rating
-    """
-    # Tutorial for sorting credit:
-    # https://www.geeksforgeeks.org/ways-sort-list-dictionaries-values-python-using-lambda-function/
-    sorted_list = sorted(terms, key=lambda i: (i["term_header"], i["rating"]))
-    return sorted_list
+# Order of the top rated definitions shown on a profile
+PROFILE_TOP_RATED_ORDER = [("rating", -1), ("_id", 1)]
 
 
-def sortTermsByRating(terms):
+def getProfileQuery(user):
     """
-    Sort provided list of terms by highest rated
+    Build the query for the definitions shown on a user's profile
     """
-    # Tutorial for sorting credit:
-    # https://www.geeksforgeeks.org/ways-sort-list-dictionaries-values-python-using-lambda-function/
-    sorted_rating = sorted(terms, key=lambda i: i["rating"], reverse=True)
-    return sorted_rating
+    return {"submitted_by": user["_id"], "rating": {"$gt": -2}}
 
 
 @app.route("/profile/<username>")
 def profile(username):
     """
-    Display user profile for chosen user
+    Display user profile for chosen user with a page of their definitions in
+    alphabetical order, their top rated definitions and how many
+    definitions they have submitted. Each is read from an index on
+    submitted_by, so the cost depends on the page size rather than the
+    number of definitions the user has submitted.
     """
     try:
-        user = mongo.db.users.find_one({"username": username})
-        terms = list(mongo.db.terms.find(
-            {"submitted_by": user["_id"], "rating": {"$gt": -2}}))
-        ordered = sortTermsAlphabetically(terms)
-        toprated = sortTermsByRating(terms)
-        games = list(mongo.db.games.find())
-        return render_template(
-            "profile.html", user=user, terms=ordered,
-            toprated=toprated, games=games)
+        user = mongo.db.users.find_one(
+            {"username": username}, {"password": 0})
+        query = getProfileQuery(user)
+        terms, next_cursor, prev_cursor = getTermsPage(
+            query,
+            after=request.args.get("after"),
+            before=request.args.get("before"),
+            per_page=getPageSize())
+        toprated = list(mongo.db.terms.find(query).sort(
+            PROFILE_TOP_RATED_ORDER).limit(app.config["PROFILE_TOP_RATED"]))
+        term_count = mongo.db.terms.count_documents(query)
+        return renderProfileTemplate(
+            user, terms, toprated, term_count, next_cursor, prev_cursor)
     except TypeError:
-        flash("This user does not exist", category="error")
-        return redirect(url_for("get_terms"))
+        return missingProfile()
+
+
+def renderProfileTemplate(user, terms, toprated, term_count, next_cursor,
+                          prev_cursor, games=None):
+    """
+    Render profile.html for a profile whose definitions have already been
+    fetched
+    """
+    game_names = getGameNames(games)
+    for term in terms + toprated:
+        term["game_name"] = game_names.get(term.get("game_fk"))
+    return render_template(
+        "profile.html", user=user, terms=terms, toprated=toprated,
+        term_count=term_count, next_cursor=next_cursor,
+        prev_cursor=prev_cursor)
+
+
+def missingProfile():
+    """
+    Send the visitor back to the dictionary when a profile doesn't exist
+    """
+    flash("This user does not exist", category="error")
+    return redirect(url_for("get_terms"))
 
 
 def updateUserRating(definition, increase):
     """
     Calculate a user's total points earned through upvotes
     """
-    user = mongo.db.users.find_one({"_id": definition["submitted_by"]})
     mongo.db.users.update_one(
-                        {"_id": user["_id"]},
+                        {"_id": definition["submitted_by"]},
                         {"$inc": {"total_rating": increase}})
 
 
@@ -374,15 +2526,61 @@ def get_games():
     is_admin = True if "admin" in session else False
 
     if is_admin:
-        games = list(
-            mongo.db.games.find().sort("game_name", 1))
-        return render_template("games.html", games=games)
+        deletions = {job["_id"]: job for job in mongo.db.deletion_jobs.find(
+            {}, {"deleted": 1, "total": 1})}
+        return render_template(
+            "games.html", games=getGames(), deletions=deletions)
     else:
         flash("You do not have permission to access this page",
               category="error")
         return redirect(url_for("get_terms"))
 
 
+@app.route("/cache_stats")
+def cache_stats():
+    """
+    Check if the user is an admin and return the hit and miss counts for the
+    reference data caches as JSON
+    """
+    is_admin = True if "admin" in session else False
+    if not is_admin:
+        return jsonify({"error": "You do not have permission to access "
+                                 "this page"}), 403
+    return jsonify({cache.name: cache.stats() for cache in (
+        games_cache, letters_cache, username_cache, page_cache,
+        fragment_cache)})
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Return the request, MongoDB, template and cache metrics in the
+    Prometheus text format. Available to admins, or to scrapers that send
+    the METRICS_TOKEN as a bearer token.
+    """
+    token = app.config["METRICS_TOKEN"]
+    authorised = "admin" in session or bool(token and hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"))
+    if not authorised:
+        return jsonify({"error": "You do not have permission to access "
+                                 "this page"}), 403
+    lines = []
+    for name, description in (
+            ("hits", "Cache lookups that found a live entry."),
+            ("misses", "Cache lookups that found no live entry."),
+            ("evictions", "Entries evicted to keep caches within size.")):
+        lines.append(f"# HELP esd_cache_{name}_total {description}")
+        lines.append(f"# TYPE esd_cache_{name}_total counter")
+        lines.extend(
+            f'esd_cache_{name}_total{{cache="{cache.name}"}} '
+            f'{cache.stats()[name]}'
+            for cache in (games_cache, letters_cache, username_cache,
+                          page_cache, fragment_cache, version_cache))
+    return Response(
+        request_metrics.export() + "\n".join(lines) + "\n",
+        mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/add_game", methods=["GET", "POST"])
 def add_game():
     """
@@ -395,8 +2593,8 @@ def add_game():
     if request.method == "POST":
         # Check if game currently exists in DB
         existing_game = mongo.db.games.find_one(
-            {"game_name": re.compile(
-                "^" + request.form.get("game_name") + "$", re.IGNORECASE)})
+            {"game_name": request.form.get("game_name")},
+            collation=CASE_INSENSITIVE)
 
         if existing_game:
             flash(Markup("Game is currently supported. You can manage "
@@ -408,11 +2606,14 @@ def add_game():
 
         # Gather form data
         game_details = {
-            "game_name": request.form.get("game_name").upper()
+            "game_name": request.form.get("game_name").upper(),
+            "term_count": 0
             }
 
         # Submit data to DB
         mongo.db.games.insert_one(game_details)
+        games_cache.invalidate()
+        bumpDictionaryVersion()
 
         flash("Game successfully added", category="success")
         return redirect(url_for("get_games"))
@@ -439,7 +2640,10 @@ def edit_game(game_id):
             "game_name": request.form.get("game_name").upper()
         }
 
-        mongo.db.games.update({"_id": ObjectId(game_id)}, update)
+        mongo.db.games.update_one({"_id": ObjectId(game_id)},
+                                  {"$set": update})
+        games_cache.invalidate()
+        bumpDictionaryVersion()
         flash("Game details updated successfully", category="success")
         return redirect(url_for("get_games"))
 
@@ -453,18 +2657,197 @@ def edit_game(game_id):
         return redirect(url_for("get_terms"))
 
 
+class GameDeletionWorker:
+    """
+    Deletes games in the background along with their definitions, votes and
+    search index entries, subtracting each deleted definition's rating from
+    its submitter's total rating. Definitions are deleted in chunks, with
+    the rating changes for each chunk written in one bulk write.
+
+    Each game being deleted has a job in the deletion_jobs collection that
+    records its progress. A chunk is saved to the job before anything is
+    deleted, and every submitter remembers the IDs of its most recent
+    chunks, so a chunk that was interrupted part way through can be retried
+    without changing anyone's rating twice. Jobs are leased by one process
+    at a time, and a job whose process died is picked up again once its
+    lease expires.
+    """
+
+    def __init__(self, chunk_size, lease_seconds):
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Start the background thread that runs jobs if it isn't running, and
+        wake it up to look for new jobs
+        """
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(
+                        target=self.run, name="game-deletion", daemon=True)
+                    self.thread.start()
+        self.wake.set()
+
+    def run(self):
+        while True:
+            try:
+                self.runJobs()
+            except Exception as error:
+                # The job's lease runs out and it is retried later
+                app.logger.error("Failed to delete game: %s", error)
+            # Check again once any lease held by a dead process has expired
+            self.wake.wait(self.lease_seconds)
+            self.wake.clear()
+
+    def runJobs(self):
+        """
+        Run every job that isn't leased by another process until it is done
+        """
+        while True:
+            job = mongo.db.deletion_jobs.find_one_and_update(
+                {"lease_until": {"$lt": datetime.utcnow()}},
+                {"$set": {"lease_until": self.leaseEnd()}},
+                return_document=ReturnDocument.AFTER)
+            if job is None:
+                return
+            while self.deleteChunk(job):
+                job = mongo.db.deletion_jobs.find_one_and_update(
+                    {"_id": job["_id"], "lease_until": job["lease_until"]},
+                    {"$set": {"lease_until": self.leaseEnd()}},
+                    return_document=ReturnDocument.AFTER)
+                if job is None:
+                    # The lease expired and another process took over
+                    break
+
+    def leaseEnd(self):
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def deleteChunk(self, job):
+        """
+        Delete the next chunk of a game's definitions, or the game itself
+        once none are left. Returns False when the job is finished.
+        """
+        chunk = job.get("chunk")
+        if chunk is None:
+            terms = list(mongo.db.terms.find(
+                {"game_fk": job["_id"]},
+                {"submitted_by": 1, "rating": 1, "term_header": 1}).limit(
+                    self.chunk_size))
+            if not terms:
+                self.finish(job)
+                return False
+            author_changes = defaultdict(int)
+            letter_changes = defaultdict(int)
+            for term in terms:
+                author_changes[term["submitted_by"]] -= term["rating"]
+                letter_changes[getTermLetter(term["term_header"])] -= 1
+            chunk = {
+                "id": ObjectId(),
+                "term_ids": [term["_id"] for term in terms],
+                "authors": [[author_id, change] for author_id, change
+                            in author_changes.items() if change],
+                "letters": letter_changes}
+            mongo.db.deletion_jobs.update_one(
+                {"_id": job["_id"]}, {"$set": {"chunk": chunk}})
+
+        if chunk["authors"]:
+            mongo.db.users.bulk_write([UpdateOne(
+                {"_id": author_id, "deletion_batches": {"$ne": chunk["id"]}},
+                {"$inc": {"total_rating": change},
+                 "$push": {"deletion_batches": {"$each": [chunk["id"]],
+                                                "$slice": -10}}})
+                for author_id, change in chunk["authors"]], ordered=False)
+        term_ids = chunk["term_ids"]
+        if vote_buffer is not None:
+            terms = mongo.db.terms.find(
+                {"_id": {"$in": term_ids}}, {"submitted_by": 1})
+            for term in terms:
+                vote_buffer.discard(term["_id"], term["submitted_by"])
+        mongo.db.votes.delete_many({"term_id": {"$in": term_ids}})
+        unindexTerms(term_ids)
+        mongo.db.terms.delete_many({"_id": {"$in": term_ids}})
+        mongo.db.games.update_one(
+            {"_id": job["_id"], "deletion_batches": {"$ne": chunk["id"]}},
+            {"$inc": {"term_count": -len(term_ids)},
+             "$push": {"deletion_batches": {"$each": [chunk["id"]],
+                                            "$slice": -10}}})
+        games_cache.invalidate()
+        if chunk.get("letters"):
+            mongo.db.counters.update_one(
+                {"_id": "letters", "deletion_batches": {"$ne": chunk["id"]}},
+                {"$inc": {f"counts.{letter}": change
+                          for letter, change in chunk["letters"].items()},
+                 "$push": {"deletion_batches": {"$each": [chunk["id"]],
+                                                "$slice": -10}}})
+            letters_cache.invalidate()
+        mongo.db.deletion_jobs.update_one(
+            {"_id": job["_id"]},
+            {"$inc": {"deleted": len(term_ids)}, "$unset": {"chunk": ""}})
+        bumpDictionaryVersion()
+        return True
+
+    def finish(self, job):
+        """
+        Remove the game once all of its definitions have been deleted
+        """
+        mongo.db.games.delete_one({"_id": job["_id"]})
+        mongo.db.deletion_jobs.delete_one({"_id": job["_id"]})
+        games_cache.invalidate()
+        bumpDictionaryVersion()
+        app.logger.info("Deleted game %s and %d definitions",
+                        job["game_name"], job["deleted"])
+
+
+game_deletion_worker = GameDeletionWorker(
+    app.config["GAME_DELETE_CHUNK_SIZE"],
+    app.config["GAME_DELETE_LEASE_SECONDS"])
+
+
+@app.before_first_request
+def resumeGameDeletions():
+    """
+    Carry on with any game deletions left unfinished by a previous process
+    """
+    try:
+        if mongo.db.deletion_jobs.find_one({}, {"_id": 1}):
+            game_deletion_worker.start()
+    except PyMongoError as error:
+        app.logger.error("Could not resume game deletions: %s", error)
+
+
 @app.route("/delete_game/<game_id>")
 def delete_game(game_id):
     """
-    Check that user is logged in and is an admin. Search the database for the
-    game being deleted and remove it.
+    Check that user is logged in and is an admin. Queue the game for
+    deletion along with all of its definitions, which are removed in the
+    background while the progress is shown on the games page.
     """
     try:
         is_admin = True if "admin" in session else False
         if is_admin:
-            mongo.db.terms.remove({"game_fk": ObjectId(game_id)})
-            mongo.db.games.remove({"_id": ObjectId(game_id)})
-            flash("Game successfully deleted", category="success")
+            game = mongo.db.games.find_one({"_id": ObjectId(game_id)})
+            if game is None:
+                flash("This game does not exist", category="error")
+                return redirect(url_for("get_games"))
+            # The job is keyed by the game, so deleting twice is harmless
+            mongo.db.deletion_jobs.update_one(
+                {"_id": game["_id"]},
+                {"$setOnInsert": {
+                    "game_name": game["game_name"],
+                    "total": mongo.db.terms.count_documents(
+                        {"game_fk": game["_id"]}),
+                    "deleted": 0,
+                    "started": datetime.utcnow(),
+                    "lease_until": datetime.utcnow()}},
+                upsert=True)
+            game_deletion_worker.start()
+            flash("Game is being deleted along with its definitions",
+                  category="success")
             return redirect(url_for("get_games"))
         else:
             flash("You do not have permission to manage supported games",
@@ -476,6 +2859,75 @@ def delete_game(game_id):
         return redirect(url_for("get_terms"))
 
 
+# Password hashing is deliberately slow, so hashes run on a small pool of
+# threads. hashlib releases the GIL while hashing, so other requests keep
+# being served, and a burst of logins queues for the pool instead of
+# taking every CPU.
+password_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, app.config["PASSWORD_HASH_WORKERS"]),
+    thread_name_prefix="password-hash")
+
+
+def getPasswordHashMethod():
+    """
+    Return the configured hash method as werkzeug records it in a hash,
+    including the PBKDF2 iteration count if the config leaves it out
+    """
+    method = app.config["PASSWORD_HASH_METHOD"]
+    if method.startswith("pbkdf2:") and method.count(":") == 1:
+        method += f":{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+def hashPassword(password):
+    """
+    Hash a password with the configured method and salt length on the
+    password pool
+    """
+    return password_pool.submit(
+        generate_password_hash, password,
+        method=getPasswordHashMethod(),
+        salt_length=app.config["PASSWORD_SALT_LENGTH"]).result()
+
+
+def verifyPassword(password_hash, password):
+    """
+    Check a password against a stored hash on the password pool
+    """
+    if not password_hash or not password:
+        return False
+    return password_pool.submit(
+        check_password_hash, password_hash, password).result()
+
+
+def passwordNeedsRehash(password_hash):
+    """
+    Check whether a stored hash was made with a different method or cost, or
+    a shorter salt, than the app is configured to use
+    """
+    method, _, rest = password_hash.partition("$")
+    salt = rest.partition("$")[0]
+    return (method != getPasswordHashMethod()
+            or len(salt) < app.config["PASSWORD_SALT_LENGTH"])
+
+
+def rehashPassword(user_id, password_hash, password):
+    """
+    Replace an outdated password hash with one using the current settings.
+    Runs on the password pool after a successful login, and only replaces
+    the hash the login was checked against so that a password changed in
+    the meantime is kept.
+    """
+    try:
+        mongo.db.users.update_one(
+            {"_id": user_id, "password": password_hash},
+            {"$set": {"password": generate_password_hash(
+                password, method=getPasswordHashMethod(),
+                salt_length=app.config["PASSWORD_SALT_LENGTH"])}})
+    except PyMongoError as error:
+        app.logger.error("Could not rehash password: %s", error)
+
+
 @app.route("/register", methods=["GET", "POST"])
 def register():
     """
@@ -485,11 +2937,9 @@ def register():
     if request.method == "POST":
         # Check if username currently exists in DB
         desired_username = request.form.get("username")
+        # Usernames are compared ignoring case using the username_ci index
         existing_username = mongo.db.users.find_one(
-            {"username": re.compile(
-                "^" + desired_username + "$", re.IGNORECASE)})
-        # Credit for case insensitivity comparison:
-        # https://stackoverflow.com/questions/6266555/querying-mongodb-via-pymongo-in-case-insensitive-efficiently
+            {"username": desired_username}, collation=CASE_INSENSITIVE)
         if existing_username:
             flash(Markup("Username already exists. "
                          "Please choose another or "
@@ -500,7 +2950,7 @@ def register():
             return redirect(url_for("register"))
 
         # Check username for profanity
-        if profanity.contains_profanity(desired_username):
+        if containsProfanity(desired_username):
             flash("This username is unavailable. Please choose another.",
                   category="error")
             return redirect(url_for("register"))
@@ -508,8 +2958,7 @@ def register():
         # Gather form data
         registration = {
             "username": request.form.get("username"),
-            "password": generate_password_hash(
-                request.form.get("password")),
+            "password": hashPassword(request.form.get("password")),
             "fav_games": request.form.get("fav_games"),
             "is_admin": False,
             "fav_competitors": request.form.get("fav_competitors"),
@@ -518,9 +2967,10 @@ def register():
 
         # Submit data to DB
         mongo.db.users.insert_one(registration)
+        username_cache.set(registration["_id"], registration["username"])
 
         # Create session cookie and redirect to dictionary
-        session["user"] = registration["username"]
+        setCurrentUser(registration)
         flash(Markup("Thanks for signing up, " + session['user']),
               category="success")
         return redirect(url_for("get_terms"))
@@ -543,18 +2993,23 @@ def login():
     if request.method == "POST":
         # Check that username exists
         existing_username = mongo.db.users.find_one(
-            {"username": re.compile(
-                "^" + request.form.get("username") + "$", re.IGNORECASE)})
+            {"username": request.form.get("username")},
+            collation=CASE_INSENSITIVE)
         if existing_username:
             # Ensure hashed password matches input
-            if check_password_hash(
-                    existing_username["password"], request.form.get(
-                    "password")):
+            password = request.form.get("password")
+            if verifyPassword(existing_username["password"], password):
+                # Upgrade hashes made with outdated settings in the
+                # background so that logging in isn't slowed down
+                if passwordNeedsRehash(existing_username["password"]):
+                    password_pool.submit(
+                        rehashPassword, existing_username["_id"],
+                        existing_username["password"], password)
                 # Check if user is an admin
                 is_admin = existing_username.get("is_admin", False)
                 if is_admin:
                     session["admin"] = True
-                session["user"] = existing_username["username"]
+                setCurrentUser(existing_username)
                 flash(Markup("Welcome, ") + session["user"],
                       category="success")
                 return redirect(url_for("get_terms"))
@@ -586,7 +3041,7 @@ def logout():
     try:
         if session["user"]:
             flash("You have logged out successfully", category="success")
-            session.pop("user")
+            setCurrentUser(None)
     except KeyError:
         flash("You are not logged in", category="error")
     try:
@@ -611,8 +3066,7 @@ def edit_user(user_id):
         current_username = user["username"]
         desired_username = request.form.get("username")
         existing_username = mongo.db.users.find_one(
-            {"username": re.compile(
-                "^" + desired_username + "$", re.IGNORECASE)})
+            {"username": desired_username}, collation=CASE_INSENSITIVE)
 
         if current_username != desired_username:
             if existing_username:
@@ -622,43 +3076,41 @@ def edit_user(user_id):
                 return redirect(url_for("edit_user", user_id=user["_id"]))
 
         # Check username for profanity
-        if profanity.contains_profanity(desired_username):
+        if containsProfanity(desired_username):
             flash("This username is unavailable. Please choose another.",
                   category="error")
             return redirect(url_for("edit_user", user_id=user["_id"]))
 
         # Ensure hashed password matches input
-        if check_password_hash(
-                    user["password"], request.form.get(
-                        "password")):
-            # Gather form data
+        password = request.form.get("password")
+        if verifyPassword(user["password"], password):
+            # Only hash a password again if it has changed or the stored
+            # hash uses outdated settings
             new_password = request.form.get("new-password")
             if new_password:
-                update = {
-                    "username": request.form.get("username"),
-                    "password": generate_password_hash(
-                        new_password),
-                    "fav_games": request.form.get("fav_games"),
-                    "is_admin": user["is_admin"],
-                    "fav_competitors": request.form.get("fav_competitors"),
-                    "total_rating": user["total_rating"]
-                    }
+                password_hash = hashPassword(new_password)
+            elif passwordNeedsRehash(user["password"]):
+                password_hash = hashPassword(password)
             else:
-                update = {
-                    "username": request.form.get("username"),
-                    "password": generate_password_hash(
-                        request.form.get("password")),
-                    "fav_games": request.form.get("fav_games"),
-                    "is_admin": user["is_admin"],
-                    "fav_competitors": request.form.get("fav_competitors"),
-                    "total_rating": user["total_rating"]
-                    }
-
-            # Submit data to DB
-            mongo.db.users.update({"_id": ObjectId(user_id)}, update)
+                password_hash = user["password"]
+
+            # Gather form data
+            update = {
+                "username": request.form.get("username"),
+                "password": password_hash,
+                "fav_games": request.form.get("fav_games"),
+                "fav_competitors": request.form.get("fav_competitors")
+                }
+
+            # Only the edited fields are set, so rating changes and batch
+            # markers written while the password was checked are kept
+            mongo.db.users.update_one(
+                {"_id": ObjectId(user_id)}, {"$set": update})
+            username_cache.set(user["_id"], update["username"])
+            bumpDictionaryVersion()
 
             # Create session cookie and redirect to dictionary
-            session["user"] = update["username"]
+            setCurrentUser(dict(update, _id=user["_id"]))
             flash("Details for " + session['user'] + " successfully changed",
                   category="success")
             return redirect(url_for("profile", username=session["user"]))
@@ -698,8 +3150,612 @@ def invalid_route(e):
     return render_template("404.html")
 
 
+# Static files fingerprinted by build-assets, the directory under static
+# their copies are written to and the files stored precompressed. The
+# favicon is kept at the root of the repository.
+ASSET_DIRECTORIES = ("css", "js", "images", "favicons")
+ASSET_FILES = {"favicon.ico": os.path.join(app.root_path, "favicon.ico")}
+ASSET_BUILD_DIRECTORY = "dist"
+COMPRESSED_ASSET_TYPES = (".css", ".js", ".ico", ".svg", ".webmanifest")
+# Precompressed variants in order of preference, by content encoding
+ASSET_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+STATIC_URL_PATTERN = re.compile(r"""url\((["']?)/static/([^"')?#]+)\1\)""")
+
+
+def loadAssetManifest():
+    """
+    Read the mapping of static filenames to their fingerprinted copies
+    written by build-assets, or return an empty mapping if the assets
+    haven't been built
+    """
+    path = os.path.join(
+        app.static_folder, ASSET_BUILD_DIRECTORY, "manifest.json")
+    try:
+        with open(path) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+
+
+asset_manifest = loadAssetManifest()
+
+
+def staticUrlFor(endpoint, **values):
+    """
+    Build a URL in the same way as url_for, except that static files which
+    have been fingerprinted by build-assets point at their fingerprinted
+    copy. Replaces url_for in templates.
+    """
+    if endpoint == "static":
+        filename = asset_manifest.get(values.get("filename"))
+        if filename:
+            values["filename"] = filename
+    return url_for(endpoint, **values)
+
+
+app.jinja_env.globals["url_for"] = staticUrlFor
+
+
+@app.endpoint("static")
+def static_file(filename):
+    """
+    Serve a static file. Fingerprinted copies never change, so they are
+    cached by browsers for STATIC_ASSET_MAX_AGE seconds without being
+    checked again, and served precompressed when the browser accepts it.
+    """
+    if not filename.startswith(ASSET_BUILD_DIRECTORY + "/"):
+        return app.send_static_file(filename)
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+    for name, suffix in ASSET_ENCODINGS:
+        if request.accept_encodings[name] and os.path.isfile(
+                os.path.join(app.static_folder, filename + suffix)):
+            encoding = name
+            filename += suffix
+            break
+    response = send_from_directory(
+        app.static_folder, filename, mimetype=mimetype,
+        cache_timeout=app.config["STATIC_ASSET_MAX_AGE"])
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = (
+        f"public, max-age={app.config['STATIC_ASSET_MAX_AGE']}, immutable")
+    return response
+
+
+def findCollectionScans(plan):
+    """
+    Return True if any stage of a query plan scans a whole collection
+    """
+    if plan.get("stage") == "COLLSCAN":
+        return True
+    children = plan.get("inputStages", [])
+    if "inputStage" in plan:
+        children = children + [plan["inputStage"]]
+    return any(findCollectionScans(child) for child in children)
+
+
+def getRouteQueries():
+    """
+    Return a sample of the queries that each route makes, as tuples of a
+    description, the collection, the filter and any sort or collation
+    """
+    example_id = ObjectId()
+    return [
+        ("get_terms listing", "terms", {"rating": {"$gt": -2}},
+         [("term_header", 1), ("rating", -1), ("_id", 1)], None),
+        ("profile terms", "terms",
+         {"submitted_by": example_id, "rating": {"$gt": -2}},
+         [("term_header", 1), ("rating", -1), ("_id", 1)], None),
+        ("trending feed", "terms", {"rating": {"$gt": -2}},
+         TRENDING_ORDER, None),
+        ("profile top rated", "terms",
+         {"submitted_by": example_id, "rating": {"$gt": -2}},
+         [("rating", -1), ("_id", 1)], None),
+        ("delete_game terms", "terms", {"game_fk": example_id}, None, None),
+        ("game_terms listing", "terms",
+         getGameTermsQuery({"_id": example_id}),
+         [("term_header", 1), ("rating", -1), ("_id", 1)], None),
+        ("letter_terms listing", "terms", getLetterTermsQuery("A"),
+         [("term_header", 1), ("rating", -1), ("_id", 1)], None),
+        ("session user", "users", {"username": "example"}, None, None),
+        ("login/register/edit_user", "users", {"username": "example"},
+         None, CASE_INSENSITIVE),
+        ("games list", "games", {}, [("game_name", 1)], None),
+        ("add_game", "games", {"game_name": "EXAMPLE"}, None,
+         CASE_INSENSITIVE),
+        ("search words", "search_index",
+         {"kind": "word", "token": {"$regex": "^example"}}, None, None),
+        ("search trigrams", "search_index",
+         {"kind": "gram", "token": {"$in": [" ex", "exa"]}}, None, None),
+        ("search index updates", "search_index", {"term_id": example_id},
+         None, None),
+        ("get_terms votes", "votes",
+         getUserVotesQuery(example_id, [{"_id": example_id}]), None, None),
+        ("delete_definition votes", "votes", {"term_id": example_id},
+         None, None),
+    ]
+
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes():
+    """
+    Create the indexes the routes need, then explain a sample of each
+    route's queries and fail if any of them would scan a whole collection
+    """
+    missing = ensureIndexes()
+    for index in missing:
+        print(f"Missing index: {index}")
+    scans = []
+    for description, collection, query, sort, collation in getRouteQueries():
+        cursor = mongo.db[collection].find(query, collation=collation)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        if findCollectionScans(plan):
+            scans.append(description)
+            print(f"COLLSCAN: {description} on {collection}")
+    if missing or scans:
+        sys.exit(1)
+    print("All indexes present and no route queries scan a collection")
+
+
+# Text fields checked for profanity when importing and their maximum lengths
+IMPORT_TEXT_LIMITS = {
+    "term_header": 35,
+    "short_definition": 100,
+    "long_description": 300
+}
+
+
+def readImportRows(path):
+    """
+    Read the rows of a CSV file, or a JSON lines file if the path ends in
+    .jsonl or .ndjson, as dictionaries. Each row is paired with the reason
+    it can't be read, or None. Lines that aren't JSON objects are returned
+    as rows holding the line and its number so that they can be rejected
+    without stopping the import.
+    """
+    with open(path, newline="", encoding="utf-8") as import_file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for number, line in enumerate(import_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if isinstance(row, dict):
+                    yield row, None
+                else:
+                    yield {"line_number": number,
+                           "line": line.rstrip("\r\n")}, "invalid JSON object"
+        else:
+            for row in csv.DictReader(import_file):
+                yield row, None
+
+
+def batchRows(rows, batch_size):
+    """
+    Group rows into lists of at most batch_size rows
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def screenImportRow(row):
+    """
+    Check the text fields of an imported row for profanity. Runs in the
+    import's worker processes.
+    """
+    return any(containsProfanity(row.get(field))
+               for field in DEFINITION_TEXT_FIELDS)
+
+
+def validateImportRow(row, game_ids, usernames):
+    """
+    Return the reason a row can't be imported, or None if it is valid
+    """
+    for field in ("term_header", "game_name", "short_definition",
+                  "username"):
+        if not row.get(field):
+            return f"missing {field}"
+    for field, limit in IMPORT_TEXT_LIMITS.items():
+        if len(row.get(field) or "") > limit:
+            return f"{field} longer than {limit} characters"
+    if row["game_name"].upper() not in game_ids:
+        return "unknown game"
+    if row["username"] not in usernames:
+        return "unknown user"
+    return None
+
+
+@app.cli.command("import-terms")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=1000, show_default=True,
+              help="Rows to insert in each insert_many.")
+@click.option("--workers", default=os.cpu_count(), show_default=True,
+              help="Processes used to screen rows for profanity.")
+@click.option("--username", default=None,
+              help="Submit rows without a username column as this user.")
+@click.option("--rejects", type=click.Path(dir_okay=False), default=None,
+              help="Write rejected rows and the reason to this file.")
+def import_terms(path, batch_size, workers, username, rejects):
+    """
+    Import definitions from a CSV or JSON lines file with term_header,
+    game_name, short_definition and username columns and optional
+    long_description and youtube_link columns. Rows for unknown games or
+    users, duplicates of existing definitions for the same game and rows
+    containing profanity are rejected.
+    """
+    started = time.perf_counter()
+    workers = max(1, workers)
+    game_ids = {game["game_name"].upper(): game["_id"]
+                for game in mongo.db.games.find({}, {"game_name": 1})}
+    submission_date = date.today().strftime("%Y/%m/%d")
+    trending = getNewTermTrending()
+    seen = set()
+    total = imported = 0
+    reasons = defaultdict(int)
+    rejects_file = open(rejects, "w") if rejects else None
+
+    def reject(row, reason):
+        reasons[reason] += 1
+        if rejects_file:
+            rejects_file.write(json.dumps(dict(row, reason=reason)) + "\n")
+
+    pool = concurrent.futures.ProcessPoolExecutor(workers)
+    try:
+        for rows in batchRows(readImportRows(path), batch_size):
+            total += len(rows)
+            batch = []
+            for row, reason in rows:
+                if reason:
+                    reject(row, reason)
+                    continue
+                row = {field: str(value) for field, value in row.items()
+                       if field and value not in (None, "")}
+                row.setdefault("username", username)
+                row["term_header"] = row.get("term_header", "").upper()
+                batch.append(row)
+
+            # Resolve every username in the batch with one query
+            names = list({row["username"] for row in batch
+                          if row.get("username")})
+            usernames = {user["username"]: user["_id"]
+                         for user in mongo.db.users.find(
+                             {"username": {"$in": names}}, {"username": 1})}
+            valid = []
+            for row in batch:
+                reason = validateImportRow(row, game_ids, usernames)
+                if reason:
+                    reject(row, reason)
+                else:
+                    valid.append(row)
+
+            # Skip terms that already exist for the same game
+            existing = {
+                (term["term_header"], term["game_fk"])
+                for term in mongo.db.terms.find(
+                    {"term_header": {"$in": list(
+                        {row["term_header"] for row in valid})}},
+                    {"term_header": 1, "game_fk": 1})}
+            unique = []
+            for row in valid:
+                key = (row["term_header"],
+                       game_ids[row["game_name"].upper()])
+                if key in existing or key in seen:
+                    reject(row, "duplicate")
+                else:
+                    seen.add(key)
+                    unique.append(row)
+
+            screened = pool.map(screenImportRow, unique,
+                                chunksize=max(1, len(unique) // workers))
+            definitions = []
+            definition_rows = []
+            for row, contains_profanity in zip(unique, screened):
+                if contains_profanity:
+                    reject(row, "profanity")
+                    continue
+                author_id = usernames[row["username"]]
+                definition_rows.append(row)
+                definitions.append({
+                    "term_header": row["term_header"],
+                    "letter": getTermLetter(row["term_header"]),
+                    "game_fk": game_ids[row["game_name"].upper()],
+                    "short_definition": row["short_definition"],
+                    "long_description": row.get("long_description") or False,
+                    "youtube_link": row.get("youtube_link") or False,
+                    "submitted_by": author_id,
+                    "submission_date": submission_date,
+                    "rating": 1,
+                    "upvotes": 1,
+                    "downvotes": 0,
+                    **trending
+                })
+            if not definitions:
+                continue
+
+            failed = set()
+            try:
+                mongo.db.terms.insert_many(definitions, ordered=False)
+            except BulkWriteError as error:
+                failed = {write_error["index"] for write_error
+                          in error.details["writeErrors"]}
+            inserted = [definition for index, definition
+                        in enumerate(definitions) if index not in failed]
+            for index in failed:
+                reject(definition_rows[index], "insert failed")
+            if inserted:
+                # Each definition starts with its submitter's upvote
+                mongo.db.votes.insert_many([
+                    {"term_id": definition["_id"],
+                     "user_id": definition["submitted_by"], "vote": 1}
+                    for definition in inserted], ordered=False)
+            postings = []
+            author_changes = defaultdict(int)
+            game_changes = defaultdict(int)
+            letter_changes = defaultdict(int)
+            for definition in inserted:
+                author_changes[definition["submitted_by"]] += 1
+                game_changes[definition["game_fk"]] += 1
+                letter_changes[definition["letter"]] += 1
+                postings += buildSearchPostings(definition)
+            if postings:
+                mongo.db.search_index.insert_many(postings, ordered=False)
+
+            # Apply the batch's points and counts before reading the next
+            # one, so that they match the definitions inserted if the import
+            # stops part way. A re-run rejects those definitions as
+            # duplicates and wouldn't count them again.
+            if author_changes:
+                mongo.db.users.bulk_write([
+                    UpdateOne({"_id": author_id},
+                              {"$inc": {"total_rating": change}})
+                    for author_id, change in author_changes.items()],
+                    ordered=False)
+            updateGameTermCounts(game_changes)
+            updateLetterCounts(letter_changes)
+            if inserted:
+                bumpDictionaryVersion()
+            imported += len(inserted)
+    finally:
+        pool.shutdown()
+        if rejects_file:
+            rejects_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {imported} of {total} rows in {elapsed:.2f}s "
+          f"({total / elapsed if elapsed else 0:.0f} rows/s)")
+    for reason, count in sorted(reasons.items()):
+        print(f"Rejected {count}: {reason}")
+
+
+@app.cli.command("migrate-votes")
+@click.option("--batch-size", default=500, show_default=True,
+              help="Terms to migrate in each batch.")
+def migrate_votes(batch_size):
+    """
+    Move the votes stored in the upvoted_by and downvoted_by arrays of each
+    definition into the votes collection, replacing the arrays with upvote
+    and downvote counters. Definitions are migrated in batches and can be
+    migrated again if the command is interrupted, so it can simply be run
+    again to resume. Run it before the app starts taking votes.
+    """
+    ensureIndexes()
+    query = {"$or": [{"upvoted_by": {"$exists": True}},
+                     {"downvoted_by": {"$exists": True}}]}
+    term_count = vote_count = 0
+    while True:
+        terms = list(mongo.db.terms.find(
+            query, {"upvoted_by": 1, "downvoted_by": 1}).limit(batch_size))
+        if not terms:
+            break
+        vote_requests = []
+        term_requests = []
+        for term in terms:
+            # A user in both arrays is counted as an upvote
+            votes = dict.fromkeys(term.get("downvoted_by") or [], -1)
+            votes.update(dict.fromkeys(term.get("upvoted_by") or [], 1))
+            vote_requests += [UpdateOne(
+                {"term_id": term["_id"], "user_id": user_id},
+                {"$set": {"vote": vote}}, upsert=True)
+                for user_id, vote in votes.items()]
+            upvotes = sum(vote == 1 for vote in votes.values())
+            term_requests.append(UpdateOne(
+                {"_id": term["_id"]},
+                {"$set": {"upvotes": upvotes,
+                          "downvotes": len(votes) - upvotes},
+                 "$unset": {"upvoted_by": "", "downvoted_by": ""}}))
+        # Votes are written before the arrays are removed, so a batch that
+        # is interrupted is picked up again on the next run
+        if vote_requests:
+            mongo.db.votes.bulk_write(vote_requests, ordered=False)
+        mongo.db.terms.bulk_write(term_requests, ordered=False)
+        term_count += len(terms)
+        vote_count += len(vote_requests)
+    if term_count:
+        bumpDictionaryVersion()
+    print(f"Migrated {term_count} terms and {vote_count} votes")
+
+
+@app.cli.command("decay-trending")
+def decay_trending():
+    """
+    Bring every definition's trending score up to date, scoring definitions
+    that don't have a score yet. Run it from a scheduler at the start of
+    each epoch when the app's TRENDING_DECAY_INTERVAL is set to 0, so the
+    first visitor to the trending feed doesn't wait for the decay.
+    """
+    ensureIndexes()
+    count = decayTrendingScores()
+    print(f"Updated the trending scores of {count} terms")
+
+
+@app.cli.command("count-game-terms")
+def count_game_terms():
+    """
+    Count every game's definitions from scratch and store the counts shown
+    in the game dropdown. Only needed for games added before the counts
+    were kept.
+    """
+    counts = {row["_id"]: row["count"] for row in mongo.db.terms.aggregate(
+        [{"$group": {"_id": "$game_fk", "count": {"$sum": 1}}}])}
+    games = list(mongo.db.games.find({}, {"game_name": 1}))
+    if games:
+        mongo.db.games.bulk_write([
+            UpdateOne({"_id": game["_id"]},
+                      {"$set": {"term_count": counts.get(game["_id"], 0)}})
+            for game in games], ordered=False)
+    games_cache.invalidate()
+    bumpDictionaryVersion()
+    for game in games:
+        print(f"{game['game_name']}: {counts.get(game['_id'], 0)} terms")
+
+
+@app.cli.command("index-letters")
+def index_letters():
+    """
+    Record the letter every definition is listed under and count the
+    definitions under each letter from scratch. Only needed for definitions
+    submitted before the alphabet index existed.
+    """
+    ensureIndexes()
+    requests = []
+    counts = defaultdict(int)
+    for term in mongo.db.terms.find({}, {"term_header": 1, "letter": 1}):
+        letter = getTermLetter(term["term_header"])
+        counts[letter] += 1
+        if term.get("letter") != letter:
+            requests.append(UpdateOne(
+                {"_id": term["_id"]}, {"$set": {"letter": letter}}))
+        if len(requests) >= 1000:
+            mongo.db.terms.bulk_write(requests, ordered=False)
+            requests = []
+    if requests:
+        mongo.db.terms.bulk_write(requests, ordered=False)
+    mongo.db.counters.update_one(
+        {"_id": "letters"}, {"$set": {"counts": dict(counts)}}, upsert=True)
+    letters_cache.invalidate()
+    bumpDictionaryVersion()
+    for letter in LETTERS:
+        print(f"{letter}: {counts.get(letter, 0)} terms")
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index():
+    """
+    Build the search index from scratch for every definition in the
+    database. Only needed for terms submitted before the index existed.
+    """
+    ensureIndexes()
+    mongo.db.search_index.delete_many({})
+    count = 0
+    for term in mongo.db.terms.find():
+        indexTerm(term)
+        count += 1
+    print(f"Indexed {count} terms")
+
+
+def fingerprintAsset(filename, content):
+    """
+    Return the path under the build directory for a static file, with a
+    hash of its content added before the extension
+    """
+    name, extension = os.path.splitext(filename)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{ASSET_BUILD_DIRECTORY}/{name}.{digest}{extension}"
+
+
+def writeAsset(filename, content):
+    """
+    Write a fingerprinted copy of a static file, along with gzip and brotli
+    variants for text formats where they are smaller. Returns the number of
+    variants written.
+    """
+    path = os.path.join(app.static_folder, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = {"": content}
+    if filename.endswith(COMPRESSED_ASSET_TYPES):
+        variants[".gz"] = gzip.compress(content, 9, mtime=0)
+        if brotli is not None:
+            variants[".br"] = brotli.compress(content)
+    written = 0
+    for suffix, data in variants.items():
+        if suffix and len(data) >= len(content):
+            continue
+        with open(path + suffix, "wb") as asset:
+            asset.write(data)
+        written += 1
+    return written
+
+
+@app.cli.command("compile-templates")
+def compile_templates():
+    """
+    Compile every template into the bytecode cache in TEMPLATE_CACHE_DIR,
+    so that processes started afterwards load them without compiling them
+    """
+    if app.jinja_env.bytecode_cache is None:
+        sys.exit("TEMPLATE_CACHE_DIR isn't set")
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    print(f"Compiled {len(names)} templates")
+
+
+@app.cli.command("build-assets")
+def build_assets():
+    """
+    Write fingerprinted copies of the static files, with gzip and brotli
+    variants of text files, and a manifest used by the templates to link to
+    them. Stylesheet links to other static files are pointed at their
+    fingerprinted copies too. Run it whenever the static files change.
+    """
+    global asset_manifest
+    sources = dict(ASSET_FILES)
+    for directory in ASSET_DIRECTORIES:
+        root = os.path.join(app.static_folder, directory)
+        for folder, _, files in os.walk(root):
+            for name in files:
+                path = os.path.join(folder, name)
+                filename = os.path.relpath(path, app.static_folder)
+                sources[filename.replace(os.sep, "/")] = path
+
+    # Stylesheets are built last so that the files they link to already
+    # have fingerprinted copies
+    manifest = {}
+    variants = 0
+    for filename in sorted(sources, key=lambda name: name.endswith(".css")):
+        with open(sources[filename], "rb") as source:
+            content = source.read()
+        if filename.endswith(".css"):
+            content = STATIC_URL_PATTERN.sub(
+                lambda match: "url({0}/static/{1}{0})".format(
+                    match.group(1),
+                    manifest.get(match.group(2), match.group(2))),
+                content.decode("utf-8")).encode("utf-8")
+        manifest[filename] = fingerprintAsset(filename, content)
+        variants += writeAsset(manifest[filename], content)
+
+    path = os.path.join(
+        app.static_folder, ASSET_BUILD_DIRECTORY, "manifest.json")
+    with open(path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    asset_manifest = manifest
+    print(f"Built {len(manifest)} assets ({variants} files)"
+          + ("" if brotli else ", without brotli as it isn't installed"))
+
+
 if __name__ == "__main__":
     app.run(host=os.environ.get("IP"),
             port=int(os.environ.get("PORT")),
             debug=False)
-    profanity.load_censor_words()
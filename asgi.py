@@ -0,0 +1,471 @@
+"""
+ASGI entry point for the Esports Dictionary.
+
+The dictionary, profile and vote routes are served by coroutines that read
+and write MongoDB through Motor, so the independent queries a page needs run
+at the same time and a worker can serve other requests while it waits for
+the database. Every other route, and any request these coroutines don't
+handle, is passed to the Flask app on a pool of threads.
+
+Flask's request context is tied to the thread that pushed it, so each
+coroutine only pushes a context while it reads the request and while it
+renders the response, never across an await. Responses are rendered on the
+thread pool too, so templates, compression and any pymongo query a render
+falls back on don't block the event loop. Votes are applied with the same
+steps as the Flask app, run with Motor.
+
+Run with: uvicorn asgi:application --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import concurrent.futures
+import io
+import time
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from flask import jsonify, request, session
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from werkzeug.exceptions import HTTPException
+
+from app import (
+    app, page_cache, games_cache, letters_cache, username_cache,
+    version_cache, vote_buffer, request_queries, cachedPageResponse,
+    decodeCursor, getCurrentUserQuery, getPageSize, getProfileQuery,
+    getUserVotesQuery, missingProfile, renderProfileTemplate,
+    renderTermsPage, renderTermsTemplate, splitTermsPage, termsPageQuery,
+    voteError, voteSteps, LISTING_PROJECTION, PROFILE_TOP_RATED_ORDER)
+
+# Routes that aren't served by a coroutine run on these threads
+wsgi_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=app.config["ASGI_WSGI_THREADS"],
+    thread_name_prefix="wsgi")
+motor_client = None
+
+
+def getDatabase():
+    """
+    Return the Motor database for the URI in MONGO_URI. The client is created
+    on first use so that it belongs to the server's event loop.
+    """
+    global motor_client
+    if motor_client is None:
+        motor_client = AsyncIOMotorClient(app.config["MONGO_URI"])
+    return motor_client.get_default_database()
+
+
+def buildEnviron(scope, body):
+    """
+    Build a WSGI environ from an ASGI HTTP scope and the request body
+    """
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode(
+            "utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    if scope.get("server"):
+        environ["SERVER_NAME"] = scope["server"][0]
+        environ["SERVER_PORT"] = str(scope["server"][1])
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+
+def responseStart(status, headers):
+    """
+    Build the ASGI message that starts a response
+    """
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers]
+    }
+
+
+async def runWsgi(environ, send):
+    """
+    Serve a request with the Flask app on the WSGI thread pool, sending the
+    response body to the client as the app produces it
+    """
+    loop = asyncio.get_running_loop()
+
+    def sendFromThread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and started.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            started["message"] = responseStart(status, headers)
+
+        body = app(environ, start_response)
+        try:
+            for chunk in body:
+                if not started.get("sent"):
+                    sendFromThread(started["message"])
+                    started["sent"] = True
+                if chunk:
+                    sendFromThread({"type": "http.response.body",
+                                    "body": chunk, "more_body": True})
+            if not started.get("sent"):
+                sendFromThread(started["message"])
+            sendFromThread({"type": "http.response.body"})
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+    await loop.run_in_executor(wsgi_pool, run)
+
+
+def readRequest(environ, reader):
+    """
+    Call reader with a request context pushed, so that it can read the
+    request and session, and return what it returns
+    """
+    with app.request_context(environ):
+        return reader()
+
+
+async def respond(environ, view):
+    """
+    Call view with a request context pushed and turn its return value into a
+    finished response, running the app's after request functions and saving
+    the session the same way a request served by Flask would. Rendering,
+    compression and anything else the view or the request functions do is
+    run on the WSGI thread pool, so that it doesn't hold up the event loop.
+    """
+    def run():
+        with app.request_context(environ):
+            try:
+                rv = app.preprocess_request()
+                if rv is None:
+                    rv = view()
+            except Exception as error:
+                try:
+                    rv = app.handle_user_exception(error)
+                except Exception as unhandled:
+                    rv = app.handle_exception(unhandled)
+            return app.finalize_request(rv)
+
+    return await asyncio.get_running_loop().run_in_executor(wsgi_pool, run)
+
+
+async def sendResponse(send, environ, response):
+    """
+    Send a finished Flask response to the client
+    """
+    app_iter, status, headers = response.get_wsgi_response(environ)
+    await send(responseStart(status, headers))
+    await send({"type": "http.response.body",
+                "body": b"".join(app_iter)})
+
+
+async def getGames(db):
+    """
+    Return the list of supported games from the cache shared with the Flask
+    app, fetching it if it isn't cached
+    """
+    games, missing = games_cache.getMany(["games"])
+    if not missing:
+        return games["games"]
+    games = await db.games.find().sort("game_name", 1).to_list(None)
+    games_cache.set("games", games)
+    return games
+
+
+async def cacheLetterCounts(db):
+    """
+    Fetch the number of definitions under each letter if it isn't cached, so
+    that rendering the page finds the counts in the cache
+    """
+    _, missing = letters_cache.getMany(["counts"])
+    if missing:
+        counter = await db.counters.find_one({"_id": "letters"})
+        letters_cache.set("counts", counter.get("counts", {})
+                          if counter else {})
+
+
+async def cacheUsernames(db, user_ids):
+    """
+    Fetch the usernames for the provided user IDs that aren't cached, so that
+    rendering the page finds every username in the cache
+    """
+    _, missing = username_cache.getMany(set(user_ids))
+    if missing:
+        async for user in db.users.find(
+                {"_id": {"$in": missing}}, {"username": 1}):
+            username_cache.set(user["_id"], user["username"])
+
+
+async def getDictionaryVersion(db):
+    """
+    Return the current version of the dictionary, checking the database at
+    most once every DICTIONARY_VERSION_TTL seconds
+    """
+    version, missing = version_cache.getMany(["version"])
+    if not missing:
+        return version["version"]
+    counter = await db.counters.find_one({"_id": "dictionary"})
+    version = counter["version"] if counter else 0
+    version_cache.set("version", version)
+    return version
+
+
+async def bumpDictionaryVersion(db):
+    """
+    Record that the dictionary has changed so that cached pages are no
+    longer served
+    """
+    counter = await db.counters.find_one_and_update(
+        {"_id": "dictionary"}, {"$inc": {"version": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    version_cache.set("version", counter["version"])
+
+
+async def fetchTermsPage(db, query, args, projection=None):
+    """
+    Fetch a page of terms matching the query with the page arguments read
+    from the request by readPageArgs, limited to the fields in the
+    projection if one is provided
+    """
+    after_key = decodeCursor(args["after"])
+    before_key = decodeCursor(args["before"])
+    query, sort_order = termsPageQuery(query, after_key, before_key)
+    terms = await db.terms.find(query, projection).sort(sort_order).to_list(
+        args["per_page"] + 1)
+    return splitTermsPage(terms, args["per_page"], after_key, before_key)
+
+
+def readPageArgs():
+    """
+    Read the cursors and page size for a page of terms from the request
+    """
+    return {
+        "after": request.args.get("after"),
+        "before": request.args.get("before"),
+        "per_page": getPageSize()
+    }
+
+
+async def get_terms(environ, db):
+    """
+    Serve a page of the dictionary. The page, the games and the logged in
+    user are fetched at the same time, followed by any usernames that
+    aren't cached and the user's votes on the page. Logged out visitors are
+    served from the page cache when possible. Searches are handed to the
+    Flask app.
+    """
+    def readTermsRequest():
+        if request.args.get("q", "").strip():
+            return None
+        args = readPageArgs()
+        args["user"] = getCurrentUserQuery()
+        args["cached"] = "user" not in session and "_flashes" not in session
+        args["full_path"] = request.full_path
+        return args
+
+    args = readRequest(environ, readTermsRequest)
+    if args is None:
+        return None
+    if args["cached"]:
+        version = await getDictionaryVersion(db)
+        if page_cache.peek((version, args["full_path"])):
+            return await respond(
+                environ, lambda: cachedPageResponse(renderTermsPage))
+
+    pending = [fetchTermsPage(db, {"rating": {"$gt": -2}}, args,
+                              LISTING_PROJECTION),
+               getGames(db), cacheLetterCounts(db)]
+    if args["user"]:
+        pending.append(db.users.find_one(args["user"], {"_id": 1}))
+    page, games, _, *user = await asyncio.gather(*pending)
+    terms, next_cursor, prev_cursor = page
+    pending = [cacheUsernames(db, (term["submitted_by"] for term in terms))]
+    if user and user[0] and terms:
+        pending.append(db.votes.find(
+            getUserVotesQuery(user[0]["_id"], terms),
+            {"_id": 0, "term_id": 1, "vote": 1}).to_list(None))
+    _, *votes = await asyncio.gather(*pending)
+    votes = {vote["term_id"]: vote["vote"] for vote in votes[0]} \
+        if votes else {}
+
+    def render():
+        return renderTermsTemplate(
+            terms, games, next_cursor, prev_cursor, "", votes)
+
+    if args["cached"]:
+        return await respond(environ, lambda: cachedPageResponse(render))
+    return await respond(environ, render)
+
+
+async def profile(environ, db, username):
+    """
+    Serve a user's profile. The user and the games are fetched at the same
+    time, then the page of definitions, the top rated definitions and the
+    number of definitions.
+    """
+    args = readRequest(environ, readPageArgs)
+    user, games = await asyncio.gather(
+        db.users.find_one({"username": username}, {"password": 0}),
+        getGames(db))
+    if user is None:
+        return await respond(environ, missingProfile)
+    query = getProfileQuery(user)
+    page, toprated, term_count = await asyncio.gather(
+        fetchTermsPage(db, query, args),
+        db.terms.find(query).sort(PROFILE_TOP_RATED_ORDER).to_list(
+            app.config["PROFILE_TOP_RATED"]),
+        db.terms.count_documents(query))
+    terms, next_cursor, prev_cursor = page
+    return await respond(environ, lambda: renderProfileTemplate(
+        user, terms, toprated, term_count, next_cursor, prev_cursor, games))
+
+
+async def runSteps(db, steps):
+    """
+    Run the database operations yielded by a step generator with Motor,
+    sending each result back, and return what the generator returns. An
+    operation that fails is raised inside the generator, as the Flask app's
+    runSteps does.
+    """
+    resume, value = steps.send, None
+    try:
+        while True:
+            collection, method, args, kwargs = resume(value)
+            try:
+                value = await getattr(db[collection], method)(*args, **kwargs)
+                resume = steps.send
+            except PyMongoError as error:
+                resume, value = steps.throw, error
+    except StopIteration as stop:
+        return stop.value
+
+
+async def castVote(environ, db, term_id, direction):
+    """
+    Apply a vote from the logged in user with the Flask app's voteSteps,
+    returning the term's new rating and the user's vote as JSON. Requests
+    other than POST are handed to the Flask app.
+    """
+    method, user_query = readRequest(
+        environ, lambda: (request.method, getCurrentUserQuery()))
+    if method != "POST":
+        return None
+    user = None
+    if user_query:
+        user = await db.users.find_one(user_query, {"_id": 1})
+    if user is None:
+        return await respond(environ, lambda: voteError(401))
+    try:
+        term_id = ObjectId(term_id)
+    except InvalidId:
+        return await respond(environ, lambda: voteError(404))
+
+    result = await runSteps(db, voteSteps(term_id, user["_id"], direction))
+    if result is None:
+        return await respond(environ, lambda: voteError(404))
+    if vote_buffer is None:
+        # Buffered ratings change the dictionary when they are flushed
+        await bumpDictionaryVersion(db)
+    return await respond(environ, lambda: jsonify(result))
+
+
+async def upvote(environ, db, term_id, username):
+    return await castVote(environ, db, term_id, 1)
+
+
+async def downvote(environ, db, term_id, username):
+    return await castVote(environ, db, term_id, -1)
+
+
+# Endpoints of the Flask app that are served by coroutines
+ASYNC_VIEWS = {
+    "get_terms": get_terms,
+    "profile": profile,
+    "upvote": upvote,
+    "downvote": downvote
+}
+
+
+async def lifespan(receive, send):
+    """
+    Acknowledge the server's startup and shutdown events. Pending vote
+    changes are flushed on shutdown in write-behind mode.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if vote_buffer is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    wsgi_pool, vote_buffer.flush)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """
+    ASGI application serving the routes in ASYNC_VIEWS with coroutines and
+    every other route with the Flask app
+    """
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    environ = buildEnviron(scope, body)
+    environ["metrics.started"] = time.perf_counter()
+
+    try:
+        endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None
+    view = ASYNC_VIEWS.get(endpoint)
+    if view is not None:
+        if not app.got_first_request:
+            # Creates the indexes on the first request, as Flask would
+            await asyncio.get_running_loop().run_in_executor(
+                wsgi_pool, app.try_trigger_before_first_request_functions)
+        # Motor sends commands from its threads with this task's context,
+        # so they are recorded against the request
+        environ["metrics.queries"] = []
+        request_queries.set(environ["metrics.queries"])
+        try:
+            response = await view(environ, getDatabase(), **view_args)
+        except Exception as error:
+            def raiseError(error=error):
+                raise error
+            response = await respond(environ, raiseError)
+        if response is not None:
+            return await sendResponse(send, environ, response)
+    await runWsgi(environ, send)
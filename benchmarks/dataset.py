@@ -0,0 +1,223 @@
+"""
+Seeded generator for benchmark datasets.
+
+Fills the games, users, terms and votes collections with a synthetic
+dictionary of a given size, along with the search index and the indexes the
+routes need.
+The same seed always produces the same documents, including their IDs but
+not password salts, so results from different commits are measured against
+identical data. Votes follow a heavy tailed distribution: most terms have a
+handful of votes and a few popular terms have thousands. Every
+user's total rating matches the ratings of the terms they submitted.
+
+Runs against the database in MONGO_URI. Existing games, users, terms, votes
+and search index documents are removed first, so only point it at a database
+used for benchmarking.
+
+Usage: python benchmarks/dataset.py --size 100k --seed 1 --drop
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app import (  # noqa: E402
+    mongo, letters_cache, buildSearchPostings, bumpDictionaryVersion,
+    ensureIndexes, getTermLetter, getTrendingEpoch, getTrendingWeight,
+    hashPassword)
+
+# Named dataset sizes, in terms
+SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+# Password shared by every generated user, hashed once rather than for
+# each of them
+PASSWORD = "benchmark"
+SYLLABLES = (
+    "ag", "ba", "bo", "cam", "ch", "da", "dr", "el", "fa", "gank", "ge", "hi",
+    "im", "jo", "ka", "ki", "la", "lo", "ma", "me", "ne", "no", "op", "pa",
+    "pi", "qu", "ra", "ro", "sa", "sh", "sk", "ta", "th", "to", "ul", "va",
+    "we", "xi", "yo", "za")
+WORDS = (
+    "attack", "block", "bonus", "build", "burst", "camp", "carry", "chain",
+    "charge", "combo", "cooldown", "damage", "defend", "dodge", "enemy",
+    "farm", "flank", "frame", "health", "heal", "jump", "lane", "level",
+    "map", "mana", "match", "meta", "objective", "player", "push", "rank",
+    "respawn", "round", "rush", "shield", "shot", "skill", "spawn", "speed",
+    "stack", "stun", "support", "tank", "team", "timing", "tower", "ultimate",
+    "weapon", "win", "zone")
+
+
+def parseSize(size):
+    """
+    Turn a size such as 1k, 100k, 1m or a plain number into a term count
+    """
+    return SIZES.get(size.lower()) or int(size)
+
+
+def seededId(rng):
+    """
+    Generate an ObjectId from the seeded random number generator
+    """
+    return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+
+def makeWord(rng, syllables):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def makeSentence(rng, low, high):
+    return " ".join(rng.choice(WORDS)
+                    for _ in range(rng.randint(low, high))).capitalize()
+
+
+def voteCount(rng, user_count):
+    """
+    Pick how many users have voted on a term. Most terms have a few votes
+    and a small number have very many.
+    """
+    return min(user_count - 1, int(rng.paretovariate(1.2)) - 1)
+
+
+def generateDataset(term_count, seed=1, batch_size=10000, log=print):
+    """
+    Replace the games, users, terms, votes and search index with a generated
+    dataset of term_count terms. Returns the number of documents written to
+    each collection.
+    """
+    rng = random.Random(seed)
+    game_count = max(10, min(500, term_count // 2000))
+    user_count = max(50, term_count // 10)
+    for collection in ("games", "users", "terms", "votes", "search_index"):
+        mongo.db[collection].delete_many({})
+
+    games = [{"_id": seededId(rng), "game_name": f"GAME {number:03d}"}
+             for number in range(game_count)]
+    mongo.db.games.insert_many(games)
+    game_ids = [game["_id"] for game in games]
+
+    user_ids = [seededId(rng) for _ in range(user_count)]
+    total_ratings = dict.fromkeys(user_ids, 0)
+    game_counts = dict.fromkeys(game_ids, 0)
+    letter_counts = {}
+    # A minority of users submit most of the definitions
+    author_weights = list(itertools.accumulate(
+        1 / (rank + 1) for rank in range(user_count)))
+
+    epoch = getTrendingEpoch()
+    started = time.monotonic()
+    written = 0
+    postings = 0
+    vote_count = 0
+    while written < term_count:
+        terms = []
+        votes = []
+        for _ in range(min(batch_size, term_count - written)):
+            author = rng.choices(user_ids, cum_weights=author_weights)[0]
+            voters = rng.sample(user_ids, voteCount(rng, user_count) + 1)
+            if author in voters:
+                voters.remove(author)
+            downvote_count = int(len(voters) * rng.random() * 0.4)
+            upvoted_by = [author] + voters[downvote_count:]
+            downvoted_by = voters[:downvote_count]
+            rating = len(upvoted_by) - len(downvoted_by)
+            total_ratings[author] += rating
+            term_id = seededId(rng)
+            votes += [{"term_id": term_id, "user_id": user_id, "vote": 1}
+                      for user_id in upvoted_by]
+            votes += [{"term_id": term_id, "user_id": user_id, "vote": -1}
+                      for user_id in downvoted_by]
+            header = makeWord(rng, rng.randint(1, 3))
+            if rng.random() < 0.3:
+                header += " " + makeWord(rng, rng.randint(1, 2))
+            term = {
+                "_id": term_id,
+                "term_header": header.upper()[:35],
+                "letter": getTermLetter(header),
+                "game_fk": rng.choice(game_ids),
+                "short_definition": makeSentence(rng, 4, 14)[:100],
+                "long_description": (makeSentence(rng, 10, 45)[:300]
+                                     if rng.random() < 0.6 else False),
+                "youtube_link": False,
+                "submitted_by": author,
+                "submission_date": "20{:02d}/{:02d}/{:02d}".format(
+                    rng.randint(18, 23), rng.randint(1, 12),
+                    rng.randint(1, 28)),
+                "rating": rating,
+                "upvotes": len(upvoted_by),
+                "downvotes": len(downvoted_by),
+                "trending_epoch": epoch
+            }
+            # Score each term as if its votes were cast when it was submitted
+            term["trending_score"] = rating * getTrendingWeight(
+                datetime.datetime.strptime(
+                    term["submission_date"], "%Y/%m/%d"), epoch)
+            terms.append(term)
+            game_counts[term["game_fk"]] += 1
+            letter_counts[term["letter"]] = \
+                letter_counts.get(term["letter"], 0) + 1
+        mongo.db.terms.insert_many(terms, ordered=False)
+        for start in range(0, len(votes), batch_size):
+            mongo.db.votes.insert_many(
+                votes[start:start + batch_size], ordered=False)
+        term_postings = [posting for term in terms
+                         for posting in buildSearchPostings(term)]
+        for start in range(0, len(term_postings), batch_size):
+            mongo.db.search_index.insert_many(
+                term_postings[start:start + batch_size], ordered=False)
+        written += len(terms)
+        postings += len(term_postings)
+        vote_count += len(votes)
+        log(f"{written}/{term_count} terms "
+            f"({time.monotonic() - started:.0f}s)")
+
+    password_hash = hashPassword(PASSWORD)
+    users = [{
+        "_id": user_id,
+        "username": f"user{number:07d}",
+        "password": password_hash,
+        "fav_games": "",
+        "fav_competitors": "",
+        "is_admin": number == 0,
+        "total_rating": total_ratings[user_id]
+    } for number, user_id in enumerate(user_ids)]
+    for start in range(0, len(users), batch_size):
+        mongo.db.users.insert_many(
+            users[start:start + batch_size], ordered=False)
+
+    mongo.db.games.bulk_write([
+        UpdateOne({"_id": game_id}, {"$set": {"term_count": count}})
+        for game_id, count in game_counts.items()], ordered=False)
+    mongo.db.counters.update_one(
+        {"_id": "letters"}, {"$set": {"counts": letter_counts}}, upsert=True)
+    letters_cache.invalidate()
+
+    ensureIndexes()
+    bumpDictionaryVersion()
+    return {"games": game_count, "users": user_count, "terms": term_count,
+            "votes": vote_count, "search_index": postings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", default="1k",
+                        help="number of terms: 1k, 100k, 1m or a number")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--drop", action="store_true",
+                        help="confirm that existing data can be removed")
+    args = parser.parse_args()
+    if not args.drop:
+        parser.error("--drop is required, as existing games, users, terms "
+                     "and votes are removed")
+    counts = generateDataset(parseSize(args.size), args.seed, args.batch_size)
+    print(", ".join(f"{count} {name}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
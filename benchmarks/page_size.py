@@ -0,0 +1,154 @@
+"""
+Page size benchmark.
+
+Renders the dictionary pages and records how many bytes each sends in four
+modes: templates rendered with all of their whitespace and sent
+uncompressed, as the app did before whitespace trimming and response
+compression, then with whitespace trimmed, and trimmed and compressed with
+gzip and with brotli. Brotli is skipped if the Brotli package isn't
+installed. Results are written as JSON with the commit they were measured
+at.
+
+The database should hold a dataset made by benchmarks/dataset.py, or one
+can be generated first with --generate. --in-memory generates the dataset
+in mongomock instead of MONGO_URI.
+
+Usage: python benchmarks/page_size.py --per-page 200 \
+    --output results/page_size.json
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app import (  # noqa: E402
+    app, mongo, brotli, fragment_cache, page_cache)
+from dataset import generateDataset, parseSize  # noqa: E402
+from route_benchmark import getCommit  # noqa: E402
+
+# Modes measured, as the whitespace setting and the Accept-Encoding header
+MODES = (
+    ("untrimmed", False, "identity"),
+    ("trimmed", True, "identity"),
+    ("trimmed_gzip", True, "gzip"),
+    ("trimmed_br", True, "br"),
+)
+
+
+def buildPages(per_page):
+    """
+    Build the list of pages to measure from the data in the database, with
+    the user each is requested as, if any
+    """
+    user = mongo.db.users.find_one({"is_admin": False}) or \
+        mongo.db.users.find_one()
+    author = mongo.db.users.find().sort("total_rating", -1).limit(1)[0]
+    game = mongo.db.games.find_one()
+    letter = mongo.db.terms.find_one({}, {"letter": 1}).get("letter", "A")
+    query = f"?per_page={per_page}"
+    return [
+        ("get_terms (logged out)", f"/get_terms{query}", None),
+        ("get_terms", f"/get_terms{query}", user),
+        ("game_terms", f"/games/{game['game_name']}/terms{query}", user),
+        ("letter_terms", f"/terms/letter/{letter}{query}", user),
+        ("trending", f"/trending{query}", user),
+        ("profile", f"/profile/{author['username']}{query}", user),
+    ]
+
+
+def setTrimming(trim):
+    """
+    Switch whitespace trimming on or off, dropping every template and page
+    rendered with the previous setting
+    """
+    app.jinja_env.trim_blocks = trim
+    app.jinja_env.lstrip_blocks = trim
+    app.jinja_env.cache.clear()
+    page_cache.invalidate()
+    fragment_cache.invalidate()
+
+
+def measurePage(path, user, encoding):
+    """
+    Request a page with the encoding and return the number of bytes sent
+    """
+    client = app.test_client()
+    if user:
+        with client.session_transaction() as session:
+            session["user"] = user["username"]
+            session["user_id"] = str(user["_id"])
+    response = client.get(path, headers={"Accept-Encoding": encoding})
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}")
+    if response.headers.get("Content-Encoding", "identity") != encoding:
+        raise RuntimeError(f"{path} wasn't sent with {encoding}")
+    return len(response.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--per-page", type=int, default=200,
+                        help="definitions on each page")
+    parser.add_argument("--generate", default=None,
+                        help="generate a dataset of this size first, "
+                             "e.g. 1k, 100k or 1m")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--in-memory", action="store_true",
+                        help="generate the dataset in mongomock")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    if args.in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("--in-memory requires mongomock to be installed")
+        if not args.generate:
+            parser.error("--in-memory requires --generate")
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx.benchmark
+    if args.generate:
+        generateDataset(parseSize(args.generate), args.seed,
+                        log=lambda message: print(message, file=sys.stderr))
+
+    # Templates compiled from the bytecode cache would ignore the setting
+    app.jinja_env.bytecode_cache = None
+    modes = [mode for mode in MODES if mode[2] != "br" or brotli]
+    pages = buildPages(args.per_page)
+    results = {name: {"route": name, "path": path}
+               for name, path, _ in pages}
+    for mode, trim, encoding in modes:
+        setTrimming(trim)
+        for name, path, user in pages:
+            results[name][mode] = measurePage(path, user, encoding)
+    setTrimming(app.config["TRIM_TEMPLATE_WHITESPACE"])
+
+    for result in results.values():
+        print(f"{result['route']:<24} " + " ".join(
+            f"{mode} {result[mode] / 1024:>7.1f}kB" for mode, _, _ in modes),
+            file=sys.stderr)
+    report = {
+        "commit": getCommit(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "in_memory": args.in_memory,
+        "per_page": args.per_page,
+        "dataset": {name: mongo.db[name].estimated_document_count()
+                    for name in ("games", "users", "terms")},
+        "results": list(results.values())
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),
+                    exist_ok=True)
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark for the profanity matcher.
+
+Times containsProfanity against better_profanity's contains_profanity on a
+mix of clean text, banned words, leetspeak variants and banned phrases
+split by spaces or punctuation, and checks that containsProfanity flags
+every sample the library does. containsProfanity may also flag words the
+library misses when they are split into three or more pieces, which are
+counted separately. Needs no database.
+
+Usage: python benchmarks/profanity_benchmark.py --repeat 20
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app import containsProfanity, profanity, PROFANE_WORDS  # noqa: E402
+
+CLEAN_WORDS = (
+    "respawn", "aggro", "kite", "tank", "healer", "loot", "raid", "boss",
+    "cooldown", "buff", "nerf", "grind", "speedrun", "glitch", "hitbox",
+    "camping", "noob", "clutch", "combo", "frame", "parry", "dodge")
+SEPARATORS = (" ", " ", " ", ", ", ". ", "-", "_", "!? ", "  ")
+
+
+def buildSamples(count, seed):
+    """
+    Generate sample texts the length of a long description. Roughly a third
+    contain a banned word or phrase, some split up by separators.
+    """
+    rng = random.Random(seed)
+    banned = sorted(PROFANE_WORDS)
+    samples = []
+    for _ in range(count):
+        words = [rng.choice(CLEAN_WORDS) for _ in range(rng.randint(5, 45))]
+        kind = rng.random()
+        if kind < 0.15:
+            words.insert(rng.randrange(len(words)), rng.choice(banned))
+        elif kind < 0.3:
+            # Break a banned word into pieces, e.g. "b a d" or "ba-d"
+            word = rng.choice(banned).replace(" ", "")
+            cut = rng.randint(1, max(1, len(word) - 1))
+            words.insert(rng.randrange(len(words)), word[:cut])
+            words.insert(rng.randrange(len(words)), word[cut:])
+        text = words[0]
+        for word in words[1:]:
+            text += rng.choice(SEPARATORS) + word
+        samples.append(text.capitalize())
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="times to check every sample with each matcher")
+    parser.add_argument("--seed", type=int, default=12)
+    args = parser.parse_args()
+
+    samples = buildSamples(args.samples, args.seed)
+    verdicts = [(text, containsProfanity(text),
+                 profanity.contains_profanity(text)) for text in samples]
+    missed = [text for text, compiled, library in verdicts
+              if library and not compiled]
+    extra = sum(compiled and not library for _, compiled, library in verdicts)
+    flagged = sum(compiled for _, compiled, _ in verdicts)
+
+    def timeMatcher(matcher):
+        seconds = timeit.timeit(
+            lambda: [matcher(text) for text in samples], number=args.repeat)
+        return seconds / (args.repeat * len(samples)) * 1e6
+
+    library_time = timeMatcher(profanity.contains_profanity)
+    compiled_time = timeMatcher(containsProfanity)
+    print(f"{len(samples)} samples, {flagged} flagged, "
+          f"{extra} only flagged by containsProfanity")
+    print(f"better_profanity.contains_profanity: {library_time:9.1f} us/text")
+    print(f"containsProfanity:                   {compiled_time:9.1f} us/text")
+    print(f"speedup: {library_time / compiled_time:.1f}x")
+    if missed:
+        print(f"FAILED: {len(missed)} samples flagged by the library "
+              "were missed:")
+        for text in missed[:10]:
+            print(f"  {text!r}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Route benchmark suite.
+
+Sends a fixed number of requests to every route and records throughput,
+p50/p95/p99 latency and the number of MongoDB commands each request issued.
+Routes are driven in process through the Flask test client, or over HTTP
+against a running server with --base-url, in which case MongoDB commands
+aren't counted and only GET routes are measured. Results are written as
+JSON with the commit they were measured at, so runs from different commits
+can be compared.
+
+The database should hold a dataset made by benchmarks/dataset.py, or one
+can be generated first with --generate. --in-memory generates the dataset
+in mongomock instead of MONGO_URI, for a quick run without a database; it
+doesn't support the vote update pipelines, collations or command
+monitoring, so those results are only indicative. The search routes are
+skipped in memory, as mongomock runs the search aggregation over every
+posting in Python and takes over a minute per request; name them with --routes
+to run them anyway.
+
+Usage: python benchmarks/route_benchmark.py --requests 200 \
+    --output results/route_benchmark.json
+"""
+import argparse
+import datetime
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from pymongo import monitoring
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class CommandCounter(monitoring.CommandListener):
+    """
+    Count the commands sent to MongoDB by every client created after it is
+    registered
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def started(self, event):
+        with self.lock:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Listeners only apply to clients created after they are registered, so
+# this has to happen before the app creates its client
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+from app import app, mongo, encodeCursor  # noqa: E402
+from dataset import PASSWORD, WORDS, generateDataset, parseSize  # noqa: E402
+from serving_concurrency import measure, percentile  # noqa: E402
+
+
+def buildScenarios():
+    """
+    Build the list of requests to benchmark from the data in the database.
+    Each scenario names the route, the request to send and the user it is
+    sent as, if any.
+    """
+    user = mongo.db.users.find_one({"is_admin": False}) or \
+        mongo.db.users.find_one()
+    author = mongo.db.users.find().sort("total_rating", -1).limit(1)[0]
+    term = mongo.db.terms.find().sort("rating", -1).limit(1)[0]
+    page = list(mongo.db.terms.find({"rating": {"$gt": -2}}).sort(
+        [("term_header", 1), ("rating", -1), ("_id", 1)]).limit(
+            app.config["TERMS_PER_PAGE"]))
+    cursor = urllib.parse.quote(encodeCursor(page[-1]))
+    word = WORDS[0]
+    admin = mongo.db.users.find_one({"is_admin": True}) or user
+    game = mongo.db.games.find_one({"_id": term["game_fk"]}) or \
+        mongo.db.games.find_one()
+    letter = urllib.parse.quote(term.get("letter", "A"))
+
+    def scenario(name, path, method="GET", as_user=None, data=None,
+                 in_memory=True):
+        return {"name": name, "method": method, "path": path,
+                "user": as_user, "data": data, "in_memory": in_memory}
+
+    return [
+        scenario("get_terms (logged out)", "/"),
+        scenario("get_terms", "/get_terms", as_user=user),
+        scenario("get_terms page 2", f"/get_terms?after={cursor}",
+                 as_user=user),
+        scenario("get_terms search", f"/get_terms?q={word}", as_user=user,
+                 in_memory=False),
+        scenario("search", f"/search?q={word}", in_memory=False),
+        scenario("game_terms",
+                 f"/games/{urllib.parse.quote(game['game_name'])}/terms",
+                 as_user=user),
+        scenario("letter_terms", f"/terms/letter/{letter}", as_user=user),
+        scenario("trending (logged out)", "/trending"),
+        scenario("trending", "/trending", as_user=user),
+        scenario("get_terms_page", "/get_terms/page"),
+        scenario("api_term", f"/api/terms/{term['_id']}"),
+        scenario("term_details", f"/terms/{term['_id']}/details"),
+        scenario("api_games", "/api/games"),
+        scenario("api_user", f"/api/users/{author['username']}"),
+        scenario("export_terms", "/api/export/terms?since=2023-12-01"),
+        scenario("profile", f"/profile/{author['username']}"),
+        scenario("profile (self)", f"/profile/{user['username']}",
+                 as_user=user),
+        scenario("get_games", "/get_games", as_user=admin),
+        scenario("cache_stats", "/cache_stats", as_user=admin),
+        scenario("metrics", "/metrics", as_user=admin),
+        scenario("submit_definition form", "/submit_definition",
+                 as_user=user),
+        scenario("edit_definition form", f"/edit_definition/{term['_id']}",
+                 as_user=admin),
+        scenario("edit_user form", f"/edit_user/{user['_id']}",
+                 as_user=user),
+        scenario("upvote", f"/upvote/{term['_id']}/{user['username']}",
+                 method="POST", as_user=user),
+        scenario("downvote", f"/downvote/{term['_id']}/{user['username']}",
+                 method="POST", as_user=user),
+        scenario("login", "/login", method="POST",
+                 data={"username": user["username"], "password": PASSWORD}),
+        scenario("contact", "/contact"),
+    ]
+
+
+def summarise(name, latencies, errors, elapsed, commands=None):
+    """
+    Build the result for a scenario from its request latencies in seconds
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "route": name,
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mongo_ops_per_request": (round(commands / count, 2)
+                                  if commands is not None and count
+                                  else None)
+    }
+
+
+def runInProcess(scenario, requests, warmup, count_commands=True):
+    """
+    Send the scenario's request through the Flask test client one request
+    at a time, counting the MongoDB commands issued along the way
+    """
+    client = app.test_client()
+    if scenario["user"]:
+        with client.session_transaction() as session:
+            session["user"] = scenario["user"]["username"]
+            session["user_id"] = str(scenario["user"]["_id"])
+            if scenario["user"].get("is_admin"):
+                session["admin"] = True
+
+    def send():
+        if scenario["method"] == "POST":
+            if scenario["name"] == "login":
+                # Log in from a fresh session every time
+                return app.test_client().post(
+                    scenario["path"], data=scenario["data"])
+            return client.post(scenario["path"], data=scenario["data"])
+        return client.get(scenario["path"])
+
+    for _ in range(warmup):
+        send()
+    latencies = []
+    errors = 0
+    commands = command_counter.count
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = send()
+        response.get_data()
+        if response.status_code >= 500:
+            errors += 1
+        else:
+            latencies.append(time.perf_counter() - request_started)
+    elapsed = time.perf_counter() - started
+    commands = command_counter.count - commands
+    return summarise(scenario["name"], latencies, errors, elapsed,
+                     commands if count_commands else None)
+
+
+def logIn(base_url, username):
+    """
+    Log in to a running server and return the session cookie
+    """
+    parts = urllib.parse.urlsplit(base_url)
+    connection = http.client.HTTPConnection(parts.netloc, timeout=30)
+    connection.request(
+        "POST", "/login",
+        urllib.parse.urlencode({"username": username, "password": PASSWORD}),
+        {"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    cookie = response.getheader("Set-Cookie", "")
+    connection.close()
+    return cookie.split(";", 1)[0]
+
+
+def runOverHttp(scenario, base_url, concurrency, duration, cookies):
+    """
+    Load a running server with concurrent requests for the scenario
+    """
+    cookie = None
+    if scenario["user"]:
+        username = scenario["user"]["username"]
+        if username not in cookies:
+            cookies[username] = logIn(base_url, username)
+        cookie = cookies[username]
+    result = measure(base_url.rstrip("/") + scenario["path"], cookie,
+                     concurrency, duration)
+    return {
+        "route": scenario["name"],
+        "requests": result["requests"],
+        "errors": result["errors"],
+        "throughput_rps": round(result["requests_per_second"], 2),
+        "p50_ms": round(result["p50_ms"], 3),
+        "p95_ms": round(result["p95_ms"], 3),
+        "p99_ms": round(result["p99_ms"], 3),
+        "mongo_ops_per_request": None,
+        "concurrency": concurrency
+    }
+
+
+def getCommit():
+    """
+    Return the commit being benchmarked, or None outside a git checkout
+    """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per route in process")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--routes", default=None,
+                        help="comma separated route names to run")
+    parser.add_argument("--generate", default=None,
+                        help="generate a dataset of this size first, "
+                             "e.g. 1k, 100k or 1m")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--in-memory", action="store_true",
+                        help="generate the dataset in mongomock")
+    parser.add_argument("--base-url", default=None,
+                        help="benchmark a running server over HTTP")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds to load each route over HTTP")
+    parser.add_argument("--output", default=None,
+                        help="file to write the JSON results to")
+    args = parser.parse_args()
+
+    if args.in_memory:
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("--in-memory requires mongomock to be installed")
+        if not args.generate:
+            parser.error("--in-memory requires --generate")
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx.benchmark
+    if args.generate:
+        generateDataset(parseSize(args.generate), args.seed,
+                        log=lambda message: print(message, file=sys.stderr))
+
+    scenarios = buildScenarios()
+    if args.routes:
+        names = set(args.routes.split(","))
+        scenarios = [scenario for scenario in scenarios
+                     if scenario["name"] in names]
+    elif args.in_memory:
+        skipped = [scenario["name"] for scenario in scenarios
+                   if not scenario["in_memory"]]
+        if skipped:
+            print("Skipping routes too slow to run in memory: " +
+                  ", ".join(skipped), file=sys.stderr)
+        scenarios = [scenario for scenario in scenarios
+                     if scenario["in_memory"]]
+    results = []
+    cookies = {}
+    for scenario in scenarios:
+        if args.base_url:
+            if scenario["method"] != "GET":
+                continue
+            result = runOverHttp(scenario, args.base_url, args.concurrency,
+                                 args.duration, cookies)
+        else:
+            result = runInProcess(scenario, args.requests, args.warmup,
+                                  count_commands=not args.in_memory)
+        results.append(result)
+        print(f"{result['route']:<26} {result['throughput_rps']:>9.1f}/s "
+              f"p50 {result['p50_ms']:>8.2f}ms "
+              f"p95 {result['p95_ms']:>8.2f}ms "
+              f"p99 {result['p99_ms']:>8.2f}ms "
+              f"ops {result['mongo_ops_per_request']} "
+              f"errors {result['errors']}", file=sys.stderr)
+
+    report = {
+        "commit": getCommit(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "mode": "http" if args.base_url else "test_client",
+        "in_memory": args.in_memory,
+        "dataset": {name: mongo.db[name].estimated_document_count()
+                    for name in ("games", "users", "terms")},
+        "results": results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)),
+                    exist_ok=True)
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Concurrency benchmark comparing the WSGI and ASGI serving modes.
+
+Sends requests to a running server from a number of concurrent clients for
+a fixed time at each concurrency level, and reports throughput and latency
+percentiles. Start the server under test first, for example:
+
+    python app.py                                    # WSGI
+    uvicorn asgi:application --port 5000             # ASGI
+
+Usage: python benchmarks/serving_concurrency.py \
+    --url http://localhost:5000/get_terms --concurrency 1,8,32,128
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+import urllib.parse
+
+
+def runClient(url, cookie, deadline, latencies, errors):
+    """
+    Send requests one after another over a single connection until the
+    deadline, recording the latency of each successful request
+    """
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    headers = {"Cookie": cookie} if cookie else {}
+    connection = http.client.HTTPConnection(parts.netloc, timeout=30)
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            connection.close()
+            connection = http.client.HTTPConnection(parts.netloc, timeout=30)
+            continue
+        if response.status >= 500:
+            errors.append(1)
+        else:
+            latencies.append(time.monotonic() - started)
+    connection.close()
+
+
+def percentile(values, share):
+    """
+    Return the value below which the given share of the values fall
+    """
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def measure(url, cookie, concurrency, duration):
+    """
+    Run concurrency clients for duration seconds and summarise the results
+    """
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    clients = [threading.Thread(
+        target=runClient, args=(url, cookie, deadline, latencies, errors))
+        for _ in range(concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / duration,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:5000/get_terms")
+    parser.add_argument("--concurrency", default="1,8,32,128",
+                        help="comma separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="seconds to run each concurrency level for")
+    parser.add_argument("--cookie", default=None,
+                        help="Cookie header to send, e.g. session=...")
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'req/s':>9} {'mean ms':>9} {'p50 ms':>9} "
+          f"{'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        result = measure(args.url, args.cookie, concurrency, args.duration)
+        print(f"{result['concurrency']:>8} "
+              f"{result['requests_per_second']:>9.1f} "
+              f"{result['mean_ms']:>9.1f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+              f"{result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Concurrency stress test for the vote engine.
+
+Many threads cast random upvotes and downvotes on the same definition at
+once, then the final state of the definition and its submitter is checked
+for consistency. Runs against the database in MONGO_URI, using documents
+that are created for the run and removed afterwards.
+
+Usage: python benchmarks/vote_stress.py --threads 32 --votes 5000
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+from bson.objectid import ObjectId
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from app import app, mongo, applyVote, ensureIndexes  # noqa: E402
+
+
+def seedTerm(voter_count):
+    """
+    Create a definition, the user who submitted it and the users who will
+    vote on it. Returns the IDs of the term, its submitter and the voters.
+    """
+    run = ObjectId()
+    author_id = mongo.db.users.insert_one({
+        "username": f"stress-author-{run}",
+        "total_rating": 1,
+        "stress_run": run}).inserted_id
+    voter_ids = mongo.db.users.insert_many([
+        {"username": f"stress-voter-{run}-{i}", "total_rating": 0,
+         "stress_run": run} for i in range(voter_count)]).inserted_ids
+    term_id = mongo.db.terms.insert_one({
+        "term_header": f"STRESS {run}",
+        "short_definition": "Vote engine stress test",
+        "submitted_by": author_id,
+        "rating": 1,
+        "upvotes": 1,
+        "downvotes": 0,
+        "stress_run": run}).inserted_id
+    mongo.db.votes.insert_one(
+        {"term_id": term_id, "user_id": author_id, "vote": 1})
+    return run, term_id, author_id, voter_ids
+
+
+def castVotes(term_id, voter_ids, votes, errors):
+    """
+    Cast random votes from random voters, recording any exceptions raised
+    """
+    try:
+        for _ in range(votes):
+            applyVote(term_id, random.choice(voter_ids),
+                      random.choice((1, -1)))
+    except Exception as error:
+        errors.append(error)
+
+
+def checkConsistency(term_id, author_id):
+    """
+    Return a list of problems with the final state of the definition. Each
+    user may have at most one vote, the vote counters must match the votes
+    collection, the rating must equal upvotes minus downvotes and the
+    submitter's total rating must have moved by the same amount as the
+    definition's rating.
+    """
+    term = mongo.db.terms.find_one({"_id": term_id})
+    author = mongo.db.users.find_one({"_id": author_id})
+    votes = list(mongo.db.votes.find({"term_id": term_id}))
+    voters = [vote["user_id"] for vote in votes]
+    upvotes = sum(vote["vote"] == 1 for vote in votes)
+    downvotes = sum(vote["vote"] == -1 for vote in votes)
+    problems = []
+    if len(set(voters)) != len(voters):
+        problems.append("users with more than one vote")
+    if (term["upvotes"], term["downvotes"]) != (upvotes, downvotes):
+        problems.append(
+            f"counters of {term['upvotes']} upvotes and "
+            f"{term['downvotes']} downvotes do not match {upvotes} "
+            f"upvotes and {downvotes} downvotes in the votes collection")
+    if term["rating"] != upvotes - downvotes:
+        problems.append(
+            f"rating {term['rating']} does not match "
+            f"{upvotes} upvotes and {downvotes} downvotes")
+    if author["total_rating"] != term["rating"]:
+        problems.append(
+            f"submitter total_rating {author['total_rating']} does not "
+            f"match term rating {term['rating']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--voters", type=int, default=25)
+    parser.add_argument("--votes", type=int, default=2000,
+                        help="total number of votes to cast")
+    args = parser.parse_args()
+
+    with app.app_context():
+        # Concurrent first votes rely on the unique index on votes
+        ensureIndexes()
+        run, term_id, author_id, voter_ids = seedTerm(args.voters)
+        try:
+            errors = []
+            per_thread = max(1, args.votes // args.threads)
+            threads = [
+                threading.Thread(
+                    target=castVotes,
+                    args=(term_id, voter_ids, per_thread, errors))
+                for _ in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            problems = [repr(error) for error in errors]
+            problems += checkConsistency(term_id, author_id)
+        finally:
+            mongo.db.terms.delete_many({"stress_run": run})
+            mongo.db.votes.delete_many({"term_id": term_id})
+            mongo.db.users.delete_many({"stress_run": run})
+
+    total = per_thread * args.threads
+    if problems:
+        print(f"FAILED after {total} votes on {args.threads} threads:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(f"OK: {total} votes on {args.threads} threads left a "
+          "consistent definition and submitter rating")
+
+
+if __name__ == "__main__":
+    main()
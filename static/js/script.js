@@ -18,7 +18,8 @@ document.addEventListener('DOMContentLoaded', function () {
 document.addEventListener('DOMContentLoaded', function () {
   var elems = document.querySelectorAll('.collapsible');
   var instances = M.Collapsible.init(elems, {
-    outDuration: 200
+    outDuration: 200,
+    onOpenStart: loadTermDetails
   });
 });
 
@@ -45,7 +46,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
 // Functions
 /* 
-    Search for terms as user types in the searchbar
+    Search for terms on the current page as user types in the searchbar.
+    Pressing enter submits the search form to search the whole dictionary
 */
 function searchTerms() {
   const searchField = document.querySelector(".searchbar");
@@ -78,46 +80,55 @@ function clearSearchbar() {
 }
 
 
+/*
+    Clear the searchbar when the user clicks the clear button. If the page
+    is showing the results of a dictionary search, return to the dictionary
+*/
+function resetSearch() {
+  if (new URLSearchParams(window.location.search).get("q")) {
+    window.location.href = "/get_terms";
+  }
+  else clearSearchbar();
+}
+
+
 /* 
-    Filter displayed definitions based on the letter that the user selects 
-    from the alphabetical buttons displayed. Hide containers where the 
-    first letter of the term doesn't match the selected filter
+    Open the page listing the definitions under the letter that the user 
+    selects from the alphabetical buttons displayed. Letters without any
+    definitions are disabled
 */
 function filterByLetter() {
-  clearSearchbar();
-  const letter = this.innerText;
-  const allTerms = Array.from(document.querySelectorAll(".term"));
-  allTerms.forEach(term => {
-    if (term.textContent[0] !== letter) {
-      term.parentElement.parentElement.parentElement.classList.add("hidden");
-    }
-    else(term.parentElement.parentElement.parentElement.classList.remove("hidden"));
-  });
-  checkAllTermsHidden();
+  if (this.disabled || this.classList.contains("disabled")) {
+    return;
+  }
+  window.location.href = this.dataset.url;
 }
 
 
 /* 
-    Filter displayed definitions based on the game that the user selects 
-    from the game dropdown
+    Open the page listing the definitions for the game that the user
+    selects from the game dropdown
 */
 function filterByGame() {
-  clearSearchbar();
-  const chosenGame = this.value;
-  const allGameCategories = Array.from(document.querySelectorAll(".game-name"));
-  allGameCategories.forEach(gameName => {
-    if (gameName.textContent !== chosenGame) {
-      gameName.parentElement.parentElement.parentElement.classList.add("hidden");
-    }
-    else(gameName.parentElement.parentElement.parentElement.classList.remove("hidden"));
-  });
-  checkAllTermsHidden();
+  const chosenGame = this.options[this.selectedIndex];
+  window.location.href = chosenGame.dataset.url;
 }
 
 
 /* 
-    Show all definitions. Used when changing filters or when the user 
-    clicks the Clear Filters button
+    Return to the whole dictionary when the user clicks the Clear Filters
+    button on a letter or game page, otherwise show all definitions
+*/
+function clearFilters() {
+  if (this.dataset.url) {
+    window.location.href = this.dataset.url;
+  }
+  else showAllDefinitions();
+}
+
+
+/* 
+    Show all definitions. Used when changing filters
 */
 function showAllDefinitions() {
   const allTermContainers = Array.from(document.querySelectorAll(".term-container"));
@@ -224,7 +235,7 @@ function deleteTermModal(e) {
   const confirmDeleteBtn = document.querySelector(".modal-delete-btn");
   const term = e.target.dataset.id;
   modal.classList.remove("hidden");
-  confirmDeleteBtn.setAttribute("href", "delete_definition/" + term);
+  confirmDeleteBtn.setAttribute("href", "/delete_definition/" + term);
   closeBtn.addEventListener("click", function () {
     modal.classList.add("hidden");
   });
@@ -243,7 +254,7 @@ function deleteGameModal(e) {
   const confirmDeleteBtn = document.querySelector(".modal-delete-btn");
   const game = e.target.dataset.id;
   modal.classList.remove("hidden");
-  confirmDeleteBtn.setAttribute("href", "delete_game/" + game);
+  confirmDeleteBtn.setAttribute("href", "/delete_game/" + game);
   closeBtn.addEventListener("click", function () {
     modal.classList.add("hidden");
   });
@@ -301,6 +312,23 @@ function arrowOnUpvote(chosenArrow) {
 }
 
 
+/*
+    Update a term's displayed rating and arrows with the rating and vote
+    state returned by the server once a vote has been applied, correcting
+    the display if other votes were cast at the same time
+*/
+function syncRating(clickedArrow, result) {
+  const container = clickedArrow.closest(".rating-container");
+  const upArrowParent = container.querySelector(".uparrow");
+  const downArrowParent = container.querySelector(".downarrow");
+  container.querySelector(".term-rating").innerHTML = result.rating;
+  upArrowParent.classList.toggle("active", result.vote === 1);
+  upArrowParent.classList.toggle("inactive", result.vote !== 1);
+  downArrowParent.classList.toggle("active", result.vote === -1);
+  downArrowParent.classList.toggle("inactive", result.vote !== -1);
+}
+
+
 /*
     Gets the ID of the term being rated as well as the username of the user
     rating the term. Passes these details to the upvote function in app.py.
@@ -314,8 +342,13 @@ function handleUpvote(e) {
   const username = clickedArrow.dataset.user;
 
   let request = new XMLHttpRequest();
-  request.open('POST', 'upvote/' + termID + "/" + username, true);
+  request.open('POST', '/upvote/' + termID + "/" + username, true);
   request.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded; charset=UTF-8');
+  request.onload = function () {
+    if (request.status === 200) {
+      syncRating(clickedArrow, JSON.parse(request.responseText));
+    }
+  };
   request.send(termID, username);
 }
 
@@ -367,12 +400,53 @@ function handleDownvote(e) {
   const username = clickedArrow.dataset.user;
 
   let request = new XMLHttpRequest();
-  request.open('POST', 'downvote/' + termID + "/" + username, true);
+  request.open('POST', '/downvote/' + termID + "/" + username, true);
   request.setRequestHeader('Content-Type', 'application/x-www-form-urlencoded; charset=UTF-8');
+  request.onload = function () {
+    if (request.status === 200) {
+      syncRating(clickedArrow, JSON.parse(request.responseText));
+    }
+  };
   request.send(termID, username);
 }
 
 
+/*
+    Fetch a definition's description and video link the first time it is
+    expanded. Fetched details are kept so that the same definition isn't
+    requested twice, even if it appears again after the page changes.
+*/
+const termDetailsCache = {};
+
+function loadTermDetails(termContainer) {
+  const details = termContainer.querySelector(".term-details");
+  if (!details || details.dataset.loaded) {
+    return;
+  }
+  details.dataset.loaded = "true";
+  const url = details.dataset.url;
+  if (termDetailsCache[url]) {
+    details.innerHTML = termDetailsCache[url];
+    return;
+  }
+
+  let request = new XMLHttpRequest();
+  request.open('GET', url, true);
+  request.onload = function () {
+    if (request.status === 200) {
+      termDetailsCache[url] = request.responseText;
+      details.innerHTML = request.responseText;
+    } else {
+      delete details.dataset.loaded;
+    }
+  };
+  request.onerror = function () {
+    delete details.dataset.loaded;
+  };
+  request.send();
+}
+
+
 /*
     Displays modal if user tries to rate a term while not logged in to 
     encourage them to register or log in
@@ -473,7 +547,7 @@ document.addEventListener("DOMContentLoaded", function () {
   // Clear filters
   const clearFilterBtn = document.querySelectorAll(".clear-btn");
   if (clearFilterBtn) {
-    clearFilterBtn.forEach(button => button.addEventListener("click", showAllDefinitions));
+    clearFilterBtn.forEach(button => button.addEventListener("click", clearFilters));
   }
 
   // Check if password and confirm password fields match on registration page
@@ -526,7 +600,7 @@ document.addEventListener("DOMContentLoaded", function () {
   // Clear the searchbar
   const clearBtn = document.querySelector("#clear");
   if (clearBtn) {
-    clearBtn.addEventListener("click", clearSearchbar);
+    clearBtn.addEventListener("click", resetSearch);
   }
 
   // Prevent collapsible body from opening if user clicks submitted by username